@@ -1,48 +1,227 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
-from azure.storage.blob import BlobServiceClient
-from azure.identity import DefaultAzureCredential
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from concurrent.futures import ThreadPoolExecutor
+from storage import hash_stream, UploadTooLarge, DEFAULT_BLOCK_SIZE
+from backends import AzureBlobBackend, FileSystemBackend, MemoryBackend
+from jobs import BlobJournal, JobStore, JobScheduler, QueueFull, Retry, QUEUED, RUNNING, DONE, FAILED
+from result_cache import ResultCache
+from notifications import CompletionHub
+from payloads import Payload, PayloadRegistry, payload_blob_name, ref_blob_name
+from metrics import Registry, BlobMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from logging_config import configure_logging
 import uuid
 import os
-from datetime import datetime
+import hmac
+import logging
+from datetime import datetime, timezone
 import re
-import time
 import random
-import threading
+import socket
+import time
+
+# Structured JSON logs; LOG_LEVEL sets the verbosity
+configure_logging(os.environ.get('LOG_LEVEL', 'INFO'))
+# The Azure SDK logs every HTTP request and response at INFO
+logging.getLogger('azure').setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 # Security: Restrict CORS to specific origins
-CORS(app, origins=[
+CORS_ORIGINS = [
     "https://agstorage11.z19.web.core.windows.net",
     "http://localhost:5173",  # For local development
     "http://localhost:3000"   # Alternative local dev port
-])
+]
+CORS(app, origins=CORS_ORIGINS)
 
 # Security: Add security headers
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Strict-Transport-Security': 'max-age=31536000; includeSubDomains'
+}
+
 @app.after_request
 def add_security_headers(response):
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
-# Azure Blob Storage configuration - Use environment variables
+def request_route():
+    """Route template used as a metric label, so job IDs don't create new series.
+
+    Converter syntax is rewritten to the ``{name}`` form the ASGI app uses,
+    so both serving modes report the same series.
+    """
+    if request.url_rule is None:
+        return 'unmatched'
+    return re.sub(r'<(?:[^:<>]+:)?([^<>]+)>', r'{\1}', request.url_rule.rule)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    requests_in_progress.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses (/api/events) are timed until their headers are sent
+    if 'metrics_start' in g:
+        elapsed = time.perf_counter() - g.metrics_start
+        request_duration.observe(elapsed, request.method, request_route(), str(response.status_code))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'metrics_start' in g:
+        requests_in_progress.dec()
+
+# Storage configuration - Use environment variables
+# STORAGE_BACKEND is "azure", "filesystem" (under STORAGE_PATH) or "memory"
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'azure')
+STORAGE_PATH = os.environ.get('STORAGE_PATH', 'storage')
 BLOB_ACCOUNT_URL = os.environ.get('BLOB_ACCOUNT_URL', 'https://agstorage11.blob.core.windows.net')
 INPUT_CONTAINER = os.environ.get('INPUT_CONTAINER', 'input-data')
 OUTPUT_CONTAINER = os.environ.get('OUTPUT_CONTAINER', 'output-data')
 
-# Initialize blob service client
-blob_service_client = BlobServiceClient(
-    account_url=BLOB_ACCOUNT_URL,
-    credential=DefaultAzureCredential()
+# Upload configuration
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB limit
+ALLOWED_EXTENSIONS = {'.csv', '.xlsx', '.xls'}
+FILE_TOO_LARGE_ERROR = "File too large. Maximum size is 10MB."
+SERVER_BUSY_ERROR = "Server busy, please retry later."
+UPLOAD_BLOCK_SIZE = int(os.environ.get('UPLOAD_BLOCK_SIZE', DEFAULT_BLOCK_SIZE))
+UPLOAD_MAX_CONCURRENCY = int(os.environ.get('UPLOAD_MAX_CONCURRENCY', 4))
+
+# Background job configuration
+# Set only on Azure App Service
+WEBSITE_INSTANCE_ID = os.environ.get('WEBSITE_INSTANCE_ID')
+# The job table must live on local (non-network) disk: SQLite WAL doesn't
+# work on SMB shares such as App Service's /home
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH')
+# Mirror unfinished jobs to blob storage so they survive losing the job
+# table. On by default on App Service, where local disk is ephemeral.
+JOB_JOURNAL = os.environ.get('JOB_JOURNAL', 'true' if WEBSITE_INSTANCE_ID else 'false').lower() == 'true'
+JOB_JOURNAL_PREFIX = 'jobs/'
+# Owner of the jobs this host journals
+INSTANCE_ID = WEBSITE_INSTANCE_ID or socket.gethostname()
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+MAX_PENDING_JOBS = int(os.environ.get('MAX_PENDING_JOBS', 1000))
+PROCESSING_DELAY_MIN = int(os.environ.get('PROCESSING_DELAY_MIN', 120))
+PROCESSING_DELAY_MAX = int(os.environ.get('PROCESSING_DELAY_MAX', 180))
+
+# Duplicate upload configuration
+# Index blobs in the input container mapping a content digest to its job
+INPUT_INDEX_PREFIX = 'digests/'
+# How often a duplicate re-checks a source job running on another host
+DUPLICATE_RETRY_INTERVAL = 30
+# How long past the source job's due time a duplicate waits before
+# processing the upload itself
+DUPLICATE_MAX_WAIT = int(os.environ.get('DUPLICATE_MAX_WAIT', 600))
+
+# Result cache configuration
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESULT_PENDING_TTL = float(os.environ.get('RESULT_PENDING_TTL', 5))
+# Also look for per-job {job_id}.json results, written before payloads were
+# shared or by external processors. Off by default: it costs pending polls
+# for unknown jobs a second storage GET.
+LEGACY_RESULTS = os.environ.get('LEGACY_RESULTS', 'false').lower() == 'true'
+
+# Completion notification configuration
+LONG_POLL_MAX_WAIT = float(os.environ.get('LONG_POLL_MAX_WAIT', 30))
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 300))
+SSE_HEARTBEAT_INTERVAL = 15
+SSE_MAX_JOBS = 100
+# How often waiters re-check the job table for jobs finished by other workers
+COMPLETION_RECHECK_INTERVAL = 2
+
+# Job and result listing configuration
+# Security: Job IDs give access to results, so /api/jobs and /api/results
+# are disabled unless LISTING_TOKEN is set, and then require it as a bearer token
+LISTING_TOKEN = os.environ.get('LISTING_TOKEN')
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = 500
+
+# Metrics configuration
+# Security: When set, /api/metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Upload throughput buckets in bytes per second (64KB/s to 256MB/s)
+UPLOAD_THROUGHPUT_BUCKETS = tuple(2 ** n for n in range(16, 29, 2))
+
+# Security: Reject oversized request bodies before they are spooled
+# (allow some headroom for the multipart envelope)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE + 1024 * 1024
+
+# Metrics are kept in memory per process and exposed at /api/metrics
+metrics_registry = Registry()
+request_duration = metrics_registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route',
+    ('method', 'route', 'status')
+)
+requests_in_progress = metrics_registry.gauge(
+    'http_requests_in_progress', 'HTTP requests currently being handled'
+)
+blob_operation_duration = metrics_registry.histogram(
+    'blob_operation_duration_seconds', 'Blob Storage call latency by operation',
+    ('operation',)
+)
+blob_operation_errors = metrics_registry.counter(
+    'blob_operation_errors_total', 'Blob Storage error responses by operation and status',
+    ('operation', 'status')
+)
+upload_bytes = metrics_registry.counter(
+    'upload_bytes_total', 'Bytes of uploaded files written to the input container'
+)
+upload_throughput = metrics_registry.histogram(
+    'upload_throughput_bytes_per_second', 'Rate at which uploads are written to the input container',
+    buckets=UPLOAD_THROUGHPUT_BUCKETS
+)
+jobs_finished = metrics_registry.counter(
+    'jobs_finished_total', 'Jobs finished by this process, by final status', ('status',)
+)
+result_lookups = metrics_registry.counter(
+    'result_lookups_total', 'Result lookups by where they were answered (local or storage)',
+    ('source',)
 )
+blob_metrics = BlobMetrics(blob_operation_duration, blob_operation_errors)
+
+def create_storage_backend():
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'filesystem':
+        return FileSystemBackend(STORAGE_PATH)
+    if STORAGE_BACKEND == 'memory':
+        return MemoryBackend()
+    if STORAGE_BACKEND != 'azure':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    # Shared pool for staging upload blocks in parallel
+    upload_executor = ThreadPoolExecutor(
+        max_workers=int(os.environ.get('UPLOAD_WORKERS', 16)),
+        thread_name_prefix='upload'
+    )
+    # The Blob client itself is only created on first use
+    return AzureBlobBackend(
+        BLOB_ACCOUNT_URL,
+        upload_executor,
+        block_size=UPLOAD_BLOCK_SIZE,
+        max_concurrency=UPLOAD_MAX_CONCURRENCY,
+        raw_request_hook=blob_metrics.on_request,
+        raw_response_hook=blob_metrics.on_response
+    )
+
+storage_backend = create_storage_backend()
+
+# Finished results are immutable and cached in memory
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, pending_ttl=RESULT_PENDING_TTL)
+
+# Result payloads are serialized once and stored content-addressed
+payload_registry = PayloadRegistry()
+
+# Signals request threads waiting on job completion
+completion_hub = CompletionHub()
 
 def create_hardcoded_output(original_filename):
-    """Create hardcoded output JSON based on the original filename"""
-    import json
-    
+    """Create hardcoded output based on the original filename"""
     # Define hardcoded outputs based on filename
     if original_filename == "sample-alerts.csv":
         output = {
@@ -70,16 +249,268 @@ def create_hardcoded_output(original_filename):
             }
         }
     
-    return json.dumps(output, indent=2)
+    return output
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
+# Filenames with their own hardcoded output; anything else gets the default
+HARDCODED_OUTPUT_FILES = {"sample-alerts.csv", "ByAlertIdGradingNew.csv"}
+
+def output_key(original_filename):
+    """Name of the hardcoded output an uploaded file gets, None for the default"""
+    return original_filename if original_filename in HARDCODED_OUTPUT_FILES else None
+
+def output_payload(original_filename):
+    """Return the precomputed result payload for an uploaded file"""
+    return payload_registry.get_or_build(
+        output_key(original_filename), lambda: create_hardcoded_output(original_filename)
+    )
+
+def write_payload(payload):
+    """Store a payload under its digest, unless an identical one is already there"""
+    storage_backend.put(OUTPUT_CONTAINER, payload.blob_name, payload.gzip_body,
+                        overwrite=False, content_type='application/gzip')
+
+def link_result(job_id, output):
+    """Point a job at its result payload and announce that it finished"""
+    storage_backend.put(OUTPUT_CONTAINER, ref_blob_name(job_id), output.digest.encode('utf-8'))
+    
+    # Prime the result cache so the next poll doesn't hit storage,
+    # then wake any long-poll and event stream waiters
+    result_cache.put(job_id, output)
+    completion_hub.notify(job_id)
+
+def result_columns(output):
+    """Job table columns recording a finished job's result payload"""
+    return {"result": output.digest, "result_size": len(output.body)}
+
+def process_file_async(job_id, payload):
+    """Background job: create the hardcoded output for an uploaded file"""
+    source_job_id = payload.get("source_job_id")
+    if source_job_id:
+        # Duplicate upload: reuse the result of the job that processed it
+        status, output = lookup_result(source_job_id)
+        if status == "done":
+            link_result(job_id, output)
+            logger.info("Output reused", extra={"job_id": job_id, "source_job_id": source_job_id})
+            return result_columns(output)
+        if status == "pending" and time.time() < payload["wait_until"]:
+            raise Retry(DUPLICATE_RETRY_INTERVAL)
+        # The source job failed or never finished, process this upload
+        # itself and point later duplicates at this job instead
+        job_scheduler.store.take_over(job_id, source_job_id)
+        job = job_scheduler.store.get(job_id)
+        record_input_digest(job['input_digest'], job_id, payload["filename"], time.time())
+        logger.warning("Source job abandoned", extra={"job_id": job_id, "source_job_id": source_job_id})
+    
+    # Look up the precomputed output based on original filename
+    output = output_payload(payload["original_filename"])
+    
+    # Write the output once per distinct payload, then point this job at it
+    payload_registry.ensure_stored(output, write_payload)
+    link_result(job_id, output)
+    
+    logger.info("Output created", extra={"job_id": job_id, "blob": output.blob_name})
+    
+    # Finish duplicate uploads that were waiting on this job
+    for duplicate_id in job_scheduler.store.waiting_on(job_id):
+        link_result(duplicate_id, output)
+        job_scheduler.finish(duplicate_id, DONE, **result_columns(output))
+    
+    # Recorded in the job table so lookups can skip the ref blob
+    return result_columns(output)
+
+def job_db_path():
+    """Return JOB_DB_PATH, falling back to local disk if it's unset or on /home"""
+    # On App Service only /tmp is local, and it's lost when the instance restarts
+    default = '/tmp/jobs.db' if WEBSITE_INSTANCE_ID else 'jobs.db'
+    if JOB_DB_PATH is None:
+        logger.warning("JOB_DB_PATH is not set", extra={"path": default})
+        return default
+    if WEBSITE_INSTANCE_ID and os.path.abspath(JOB_DB_PATH).startswith('/home/'):
+        logger.warning("JOB_DB_PATH is on the /home network share, where SQLite can't run",
+                       extra={"path": default})
+        return default
+    return JOB_DB_PATH
+
+# Background jobs run on a bounded pool fed by a durable SQLite queue,
+# so pending jobs survive worker restarts; the journal covers losing the
+# queue itself along with the instance's disk
+job_journal = None
+if JOB_JOURNAL:
+    job_journal = BlobJournal(storage_backend, INPUT_CONTAINER, INSTANCE_ID, JOB_JOURNAL_PREFIX)
+job_scheduler = JobScheduler(
+    JobStore(job_db_path()),
+    process_file_async,
+    workers=JOB_WORKERS,
+    max_pending=MAX_PENDING_JOBS,
+    on_failed=completion_hub.notify,
+    on_finished=lambda job_id, status: jobs_finished.inc(1, status),
+    journal=job_journal
+)
+job_scheduler.start()
+
+def job_counts():
+    # Finished jobs are counted by jobs_finished_total instead of scanning their history
+    counts = job_scheduler.store.pending_counts()
+    return {(status,): count for status, count in counts.items()}
+
+metrics_registry.gauge('jobs', 'Queued and running jobs in the job table', ('status',), callback=job_counts)
+metrics_registry.gauge('jobs_in_flight', 'Jobs running in this process', callback=job_scheduler.in_flight)
+
+def validate_upload_filename(filename):
+    """Return an error message if the uploaded filename is not acceptable"""
+    # Security: Validate file type
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        return "Invalid file type. Only CSV and Excel files are allowed."
+    
+    # Security: Validate filename
+    if not re.match(r'^[a-zA-Z0-9._-]+$', filename):
+        return "Invalid filename. Only alphanumeric characters, dots, underscores, and hyphens are allowed."
+    
+    return None
+
+def schedule_processing(job_id, filename, original_filename, input_digest=None, size=None):
+    """Queue background processing of an uploaded file. Raises QueueFull.
+
+    Returns the time the job is due to run.
+    """
+    # Random delay between 2-3 minutes (120-180 seconds) by default
+    delay = random.randint(PROCESSING_DELAY_MIN, PROCESSING_DELAY_MAX)
+    job_scheduler.submit(job_id, {
+        "filename": filename,
+        "original_filename": original_filename
+    }, delay=delay, input_digest=input_digest, size=size)
+    logger.info("Processing scheduled", extra={"job_id": job_id, "blob": filename, "delay": delay})
+    return time.time() + delay
+
+def dedup_key(input_digest, original_filename):
+    """Key under which identical uploads share a job.
+
+    The output depends on the filename as well as the content, so uploads
+    only count as duplicates if both match.
+    """
+    return f"{input_digest}-{output_key(original_filename) or 'default'}"
+
+def input_index_blob_name(input_digest):
+    return f"{INPUT_INDEX_PREFIX}{input_digest}"
+
+def input_index_entry(job_id, filename, run_at):
+    """Serialized digest index entry pointing at the job that processed an input"""
+    import json
+    return json.dumps({"job_id": job_id, "filename": filename, "run_at": run_at}).encode('utf-8')
+
+def find_local_duplicate(input_digest):
+    """Return the index entry of a job on this host that processed identical content"""
+    import json
+    job = job_scheduler.store.find_by_input_digest(input_digest)
+    if job is None:
+        return None
+    return {
+        "job_id": job['job_id'],
+        "filename": json.loads(job['payload'])['filename'],
+        "run_at": job['run_at']
+    }
+
+def index_entry_abandoned(entry, status, source):
+    """Whether a digest index entry points at a job that will never finish.
+
+    ``status`` is the job's result status and ``source`` its row in this
+    host's job table, if any. A job known only through the index, with no
+    result long after it was due, was lost with another job table.
+    """
+    if status == "done":
+        return False
+    if source is not None:
+        return source['status'] == FAILED
+    run_at = entry.get("run_at")
+    return run_at is None or time.time() > run_at + DUPLICATE_MAX_WAIT
+
+def find_duplicate(input_digest):
+    """Return the index entry of a job that processed identical content, or None"""
+    import json
+    entry = find_local_duplicate(input_digest)
+    if entry is None:
+        data = storage_backend.get(INPUT_CONTAINER, input_index_blob_name(input_digest))
+        if data is None:
+            return None
+        entry = json.loads(data)
+        # Process the upload afresh, taking over the index, rather than wait on a dead job
+        status, _ = lookup_result(entry["job_id"])
+        if index_entry_abandoned(entry, status, job_scheduler.store.get(entry["job_id"])):
+            return None
+    return entry
+
+def record_input_digest(input_digest, job_id, filename, run_at):
+    """Point the digest index at the job processing this input"""
+    storage_backend.put(INPUT_CONTAINER, input_index_blob_name(input_digest),
+                        input_index_entry(job_id, filename, run_at))
+
+def schedule_duplicate(job_id, original, original_filename, input_digest, size=None):
+    """Reuse the input blob and result of ``original`` for a new job. Raises QueueFull."""
+    source_job_id = original["job_id"]
+    status, output = lookup_result(source_job_id)
+    job = {
+        "filename": original["filename"],
+        "original_filename": original_filename,
+        "source_job_id": source_job_id
+    }
+    if status == "done":
+        job_scheduler.store.add(job_id, job, time.time(), status=DONE, input_digest=input_digest,
+                                source_job_id=source_job_id, size=size, **result_columns(output))
+        link_result(job_id, output)
+        jobs_finished.inc(1, DONE)
+        return
+    
+    # Normally finished by the source job as soon as it completes; the
+    # scheduled run only matters if the source job is on another host
+    source = job_scheduler.store.get(source_job_id)
+    if source is not None and source['status'] == QUEUED:
+        delay = max(0, source['run_at'] - time.time()) + DUPLICATE_RETRY_INTERVAL
+    else:
+        delay = DUPLICATE_RETRY_INTERVAL
+    job["wait_until"] = time.time() + delay + DUPLICATE_MAX_WAIT
+    job_scheduler.submit(job_id, job, delay=delay, input_digest=input_digest,
+                         source_job_id=source_job_id, size=size)
+    
+    # The source job may have finished before this job was queued
+    status, output = lookup_local_result(source_job_id) or (None, None)
+    if status == "done":
+        link_result(job_id, output)
+        job_scheduler.finish(job_id, DONE, **result_columns(output))
+
+def force_requested(values):
+    """Whether the request asked to reprocess even if the file was seen before"""
+    return values.get('force', '').lower() in ('1', 'true', 'yes')
+
+def record_upload(size, elapsed):
+    """Count the bytes and throughput of an upload written to storage"""
+    upload_bytes.inc(size)
+    if elapsed > 0:
+        upload_throughput.observe(size / elapsed)
+
+def upload_response(job_id, filename, duplicate_of=None):
+    response = {
+        "job_id": job_id,
+        "filename": filename,
+        "message": "File uploaded successfully, processing in background...",
+        "upload_time": datetime.utcnow().isoformat()
+    }
+    if duplicate_of:
+        response["message"] = "Identical file already uploaded, reusing its results..."
+        response["duplicate_of"] = duplicate_of
+    return response
+
+def health_response():
+    return {
         "status": "OK",
         "timestamp": datetime.utcnow().isoformat(),
         "service": "Alert Grader Backend API"
-    })
+    }
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return jsonify(health_response())
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
@@ -92,99 +523,393 @@ def upload_file():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         
-        # Security: Validate file type and size
-        allowed_extensions = {'.csv', '.xlsx', '.xls'}
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
-            return jsonify({"error": "Invalid file type. Only CSV and Excel files are allowed."}), 400
+        # Security: Validate file type and filename
+        error = validate_upload_filename(file.filename)
+        if error:
+            return jsonify({"error": error}), 400
         
-        # Security: Check file size (max 10MB)
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        if file_size > 10 * 1024 * 1024:  # 10MB limit
-            return jsonify({"error": "File too large. Maximum size is 10MB."}), 400
+        # Backpressure: refuse new work while the job queue is full
+        if job_scheduler.is_full():
+            return jsonify({"error": SERVER_BUSY_ERROR}), 503, {"Retry-After": "30"}
         
-        # Security: Validate filename
-        if not re.match(r'^[a-zA-Z0-9._-]+$', file.filename):
-            return jsonify({"error": "Invalid filename. Only alphanumeric characters, dots, underscores, and hyphens are allowed."}), 400
+        # Hash the spooled upload before anything is sent to storage
+        # Security: File size (max 10MB) is enforced while hashing
+        input_digest, file_size = hash_stream(file.stream, MAX_UPLOAD_SIZE, UPLOAD_BLOCK_SIZE)
+        # Duplicates must match on content and on the output the filename selects
+        input_digest = dedup_key(input_digest, file.filename)
         
         # Generate unique ID
         unique_id = str(uuid.uuid4())
+        
+        # Identical content skips the blob write and processing
+        original = None if force_requested(request.values) else find_duplicate(input_digest)
+        if original is not None:
+            schedule_duplicate(unique_id, original, file.filename, input_digest, file_size)
+            logger.info("Duplicate upload", extra={"job_id": unique_id, "source_job_id": original['job_id']})
+            return jsonify(upload_response(unique_id, original["filename"], original["job_id"]))
+        
         filename = f"{unique_id}.csv"
         
-        # Get container clients
-        input_container_client = blob_service_client.get_container_client(INPUT_CONTAINER)
-        output_container_client = blob_service_client.get_container_client(OUTPUT_CONTAINER)
-        
-        # Upload file to input container
-        input_blob_client = input_container_client.get_blob_client(filename)
-        input_blob_client.upload_blob(file.read(), overwrite=True)
-        
-        print(f"File uploaded: {filename}")
-        
-        # Start background processing with random delay
-        def process_file_async():
-            # Random delay between 2-3 minutes (120-180 seconds)
-            delay = random.randint(120, 180)
-            print(f"Processing file {filename}, waiting {delay} seconds ({delay//60} minutes)...")
-            time.sleep(delay)
-            
-            # Create hardcoded output based on original filename
-            output_data = create_hardcoded_output(file.filename)
-            
-            # Upload output JSON to output container
-            output_filename = f"{unique_id}.json"
-            output_blob_client = output_container_client.get_blob_client(output_filename)
-            output_blob_client.upload_blob(output_data.encode('utf-8'), overwrite=True)
-            
-            print(f"Output created: {output_filename}")
-        
-        # Start background thread
-        thread = threading.Thread(target=process_file_async)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({
-            "job_id": unique_id,
-            "filename": filename,
-            "message": "File uploaded successfully, processing in background...",
-            "upload_time": datetime.utcnow().isoformat()
-        })
+        # Stream file to input container in blocks
+        upload_start = time.perf_counter()
+        storage_backend.put_stream(INPUT_CONTAINER, filename, file.stream, MAX_UPLOAD_SIZE)
         
+        record_upload(file_size, time.perf_counter() - upload_start)
+        logger.info("File uploaded", extra={"job_id": unique_id, "blob": filename, "size": file_size})
+        
+        run_at = schedule_processing(unique_id, filename, file.filename, input_digest, file_size)
+        record_input_digest(input_digest, unique_id, filename, run_at)
+        
+        return jsonify(upload_response(unique_id, filename))
+        
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return jsonify({"error": FILE_TOO_LARGE_ERROR}), 400
+    except QueueFull:
+        return jsonify({"error": SERVER_BUSY_ERROR}), 503, {"Retry-After": "30"}
     except Exception as e:
-        print(f"Upload error: {str(e)}")
+        logger.exception("Upload error")
         return jsonify({"error": f"Failed to upload file: {str(e)}"}), 500
 
+def lookup_local_result(job_id):
+    """Answer a result lookup from memory and the job table.
+
+    Returns (status, payload), ("stored", digest) when the job's payload
+    is known but has to be loaded from storage, or None if storage has to
+    be checked.
+    """
+    payload = result_cache.get(job_id)
+    if payload is not None:
+        return "done", payload
+    
+    # The local job table knows about jobs queued on this host
+    job = job_scheduler.store.get(job_id)
+    if job is not None:
+        if job['status'] in (QUEUED, RUNNING):
+            return "pending", None
+        if job['status'] == FAILED:
+            return "failed", None
+        if job['result']:
+            payload = payload_registry.get(job['result'])
+            if payload is not None:
+                return "done", result_cache.put(job_id, payload)
+            return "stored", job['result']
+    elif result_cache.is_pending(job_id):
+        # Recently seen as pending, don't go back to storage yet
+        return "pending", None
+    
+    return None
+
+def download_output_blob(name):
+    """Download a blob from the output container, or None if it doesn't exist"""
+    return storage_backend.get(OUTPUT_CONTAINER, name)
+
+def load_payload(digest):
+    """Return the payload with the given digest, loading it from storage if needed"""
+    payload = payload_registry.get(digest)
+    if payload is None:
+        data = download_output_blob(payload_blob_name(digest))
+        if data is not None:
+            payload = payload_registry.add(Payload.from_gzip(data))
+    return payload
+
+def lookup_result(job_id):
+    """Return (status, payload) for a job, going to storage only when needed"""
+    local = lookup_local_result(job_id)
+    if local is not None and local[0] != "stored":
+        result_lookups.inc(1, "local")
+        return local
+    
+    result_lookups.inc(1, "storage")
+    if local is not None:
+        payload = load_payload(local[1])
+    else:
+        # Follow the job's ref to its payload, falling back to a
+        # per-job JSON result written before payloads were shared
+        ref = download_output_blob(ref_blob_name(job_id))
+        if ref is not None:
+            payload = load_payload(ref.decode('utf-8'))
+        elif LEGACY_RESULTS:
+            data = download_output_blob(f"{job_id}.json")
+            payload = payload_registry.add(Payload.from_json(data)) if data is not None else None
+        else:
+            payload = None
+    
+    if payload is None:
+        result_cache.mark_pending(job_id)
+        return "pending", None
+    return "done", result_cache.put(job_id, payload)
+
+def wait_for_result(job_id, timeout):
+    """Block until a job finishes or ``timeout`` seconds pass"""
+    deadline = time.monotonic() + timeout
+    # Subscribe before checking so a completion in between isn't missed
+    with completion_hub.subscribe([job_id]) as subscription:
+        status, result = lookup_result(job_id)
+        while status == "pending":
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Wake up periodically to notice jobs finished by other workers
+            subscription.wait(min(remaining, COMPLETION_RECHECK_INTERVAL))
+            status, result = lookup_result(job_id)
+    return status, result
+
+def result_representation(payload, accept_encoding, if_none_match):
+    """Choose how to send a finished result. Returns (status, body, headers).
+
+    The stored bytes are sent as-is, gzipped when the client accepts it.
+    Finished results are immutable, so the ETag never goes stale.
+    """
+    headers = {
+        'Content-Type': 'application/json',
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding'
+    }
+    if parse_accept_header(accept_encoding)['gzip']:
+        body = payload.gzip_body
+        etag = f"{payload.etag}-gzip"
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        body = payload.body
+        etag = payload.etag
+    headers['ETag'] = quote_etag(etag)
+    if parse_etags(if_none_match).contains(etag):
+        return 304, b'', headers
+    return 200, body, headers
+
 @app.route('/api/result/<job_id>', methods=['GET'])
 def get_result(job_id):
-    """Get processing result from Azure Blob Storage"""
+    """Get processing result, optionally long-polling with ?wait=<seconds>"""
     try:
-        filename = f"{job_id}.json"
+        wait = min(request.args.get('wait', 0, type=float), LONG_POLL_MAX_WAIT)
+        if wait > 0:
+            status, result = wait_for_result(job_id, wait)
+        else:
+            status, result = lookup_result(job_id)
         
-        # Get container client for output data
-        container_client = blob_service_client.get_container_client(OUTPUT_CONTAINER)
-        blob_client = container_client.get_blob_client(filename)
+        if status != "done":
+            return jsonify({"status": status})
         
-        # Check if blob exists
-        if not blob_client.exists():
-            return jsonify({"status": "pending"})
-        
-        # Download and return the JSON result
-        blob_data = blob_client.download_blob().readall()
-        result = blob_data.decode('utf-8')
-        
-        # Parse JSON and return
-        import json
-        json_result = json.loads(result)
-        return jsonify(json_result)
+        status_code, body, headers = result_representation(
+            result,
+            request.headers.get('Accept-Encoding'),
+            request.headers.get('If-None-Match')
+        )
+        return app.response_class(body, status=status_code, headers=headers)
         
     except Exception as e:
-        print(f"Result error: {str(e)}")
+        logger.exception("Result error", extra={"job_id": job_id})
         return jsonify({"error": f"Failed to get result: {str(e)}"}), 500
 
+def sse_event(event, data):
+    """Format a Server-Sent Event"""
+    import json
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def completion_event(job_id, status, result):
+    """Format the event sent when a watched job finishes"""
+    import json
+    if result is None:
+        return sse_event(status, {"job_id": job_id, "status": status})
+    # Splice in the stored compact JSON rather than parsing and re-dumping it
+    body = result.body.decode('utf-8')
+    return f'event: {status}\ndata: {{"job_id": {json.dumps(job_id)}, "status": "{status}", "result": {body}}}\n\n'
+
+def parse_event_job_ids(args):
+    """Collect job IDs from repeated or comma-separated job_id parameters.
+
+    Returns (job_ids, error).
+    """
+    job_ids = []
+    for value in args.getlist('job_id'):
+        job_ids.extend(job_id for job_id in value.split(',') if job_id)
+    job_ids = list(dict.fromkeys(job_ids))
+    if not job_ids:
+        return None, "No job_id provided"
+    if len(job_ids) > SSE_MAX_JOBS:
+        return None, f"Too many job IDs. Maximum is {SSE_MAX_JOBS}."
+    return job_ids, None
+
+@app.route('/api/events', methods=['GET'])
+def job_events():
+    """Stream completion of one or more jobs as Server-Sent Events"""
+    job_ids, error = parse_event_job_ids(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    def stream():
+        remaining = set(job_ids)
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        last_sent = time.monotonic()
+        # Subscribe before checking so a completion in between isn't missed
+        with completion_hub.subscribe(job_ids) as subscription:
+            to_check = set(remaining)
+            while True:
+                for job_id in to_check & remaining:
+                    try:
+                        status, result = lookup_result(job_id)
+                    except Exception:
+                        logger.exception("Event stream error", extra={"job_id": job_id})
+                        continue
+                    if status == "pending":
+                        continue
+                    remaining.discard(job_id)
+                    last_sent = time.monotonic()
+                    yield completion_event(job_id, status, result)
+                
+                now = time.monotonic()
+                if not remaining or now >= deadline:
+                    break
+                if now - last_sent >= SSE_HEARTBEAT_INTERVAL:
+                    last_sent = now
+                    yield ": keep-alive\n\n"
+                
+                to_check = subscription.wait(min(
+                    deadline - now,
+                    COMPLETION_RECHECK_INTERVAL,
+                    SSE_HEARTBEAT_INTERVAL
+                ))
+                # Nothing signalled in this process, re-check everything
+                if not to_check:
+                    to_check = set(remaining)
+        
+        if remaining:
+            yield sse_event("timeout", {"pending": sorted(remaining)})
+    
+    response = app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def bearer_token_matches(authorization, token):
+    """Security: Constant-time check of an "Authorization: Bearer <token>" header"""
+    expected = f"Bearer {token}".encode('utf-8')
+    return hmac.compare_digest((authorization or '').encode('utf-8'), expected)
+
+def metrics_authorized(authorization):
+    """Security: Check the metrics bearer token, if one is configured"""
+    return not METRICS_TOKEN or bearer_token_matches(authorization, METRICS_TOKEN)
+
+def listing_authorized(authorization):
+    """Security: Listings need LISTING_TOKEN and are disabled without it"""
+    return bool(LISTING_TOKEN) and bearer_token_matches(authorization, LISTING_TOKEN)
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 time (UTC unless it has an offset). Raises ValueError."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def format_timestamp(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat()
+
+def encode_cursor(job, order_by):
+    """Opaque cursor pointing just past ``job`` in a listing"""
+    import base64
+    import json
+    data = json.dumps([job[order_by], job['job_id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+def decode_cursor(cursor):
+    """Return the (time, job_id) a cursor points past. Raises ValueError."""
+    import base64
+    import json
+    try:
+        value, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(value, (int, float)) or not isinstance(job_id, str):
+        raise ValueError("Invalid cursor")
+    return value, job_id
+
+def list_page(args, order_by, status=None):
+    """Fetch the page of jobs selected by the limit, cursor, since and until parameters.
+
+    Returns (jobs, next_cursor, error).
+    """
+    try:
+        limit = min(max(int(args.get('limit', LIST_DEFAULT_LIMIT)), 1), LIST_MAX_LIMIT)
+        since = parse_timestamp(args['since']) if args.get('since') else None
+        until = parse_timestamp(args['until']) if args.get('until') else None
+        after = decode_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError:
+        return None, None, "Invalid limit, cursor, since or until parameter"
+    
+    # One extra row tells whether there is another page
+    jobs = job_scheduler.store.page(limit + 1, order_by, status=status,
+                                    since=since, until=until, after=after)
+    next_cursor = encode_cursor(jobs[limit - 1], order_by) if len(jobs) > limit else None
+    return jobs[:limit], next_cursor, None
+
+def jobs_listing(args):
+    """Body of /api/jobs: uploads newest first. Returns (response, error)."""
+    import json
+    status = args.get('status') or None
+    if status is not None and status not in (QUEUED, RUNNING, DONE, FAILED):
+        return None, f"Invalid status. Use one of: {QUEUED}, {RUNNING}, {DONE}, {FAILED}."
+    jobs, next_cursor, error = list_page(args, 'created_at', status)
+    if error:
+        return None, error
+    return {
+        "jobs": [{
+            "job_id": job['job_id'],
+            "filename": json.loads(job['payload'])['filename'],
+            "status": job['status'],
+            "upload_time": format_timestamp(job['created_at']),
+            "size": job['size']
+        } for job in jobs],
+        "next_cursor": next_cursor
+    }, None
+
+def results_listing(args):
+    """Body of /api/results: finished results newest first. Returns (response, error)."""
+    jobs, next_cursor, error = list_page(args, 'finished_at', DONE)
+    if error:
+        return None, error
+    return {
+        "results": [{
+            "job_id": job['job_id'],
+            # Jobs finished before payloads were shared have a per-job result
+            "filename": payload_blob_name(job['result']) if job['result'] else f"{job['job_id']}.json",
+            "created_time": format_timestamp(job['finished_at']),
+            # Bytes of result JSON; unknown for jobs finished before it was recorded
+            "size": job['result_size'],
+            "digest": job['result']
+        } for job in jobs],
+        "next_cursor": next_cursor
+    }, None
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """List uploaded jobs, newest first, one page at a time"""
+    if not listing_authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401
+    body, error = jobs_listing(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(body)
+
+@app.route('/api/results', methods=['GET'])
+def list_results():
+    """List finished results, newest first, one page at a time"""
+    if not listing_authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401
+    body, error = results_listing(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(body)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for this process"""
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401
+    return app.response_class(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
 # REMOVED: Admin endpoints for security
-# These endpoints exposed sensitive data and were removed for production security
+# These endpoints exposed sensitive data and were removed for production security;
+# the job and result listings above are only served with LISTING_TOKEN
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8000))
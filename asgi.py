@@ -0,0 +1,550 @@
+"""Async (ASGI) entry point serving the same API as app:app.
+
+Uploads and result lookups go through one long-lived
+``azure.storage.blob.aio`` client per process with a pooled HTTP session
+and cached container clients, so a single process can hold thousands of
+concurrent uploads and polls. Local storage backends (STORAGE_BACKEND)
+are shared with app.py and run in the thread pool. Background
+processing, the job table, the result cache and completion notifications
+are shared with app.py.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 4
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import aiohttp
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity.aio import DefaultAzureCredential
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import BlobServiceClient
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders, UploadFile
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import app as core
+from jobs import QueueFull
+from payloads import Payload, payload_blob_name, ref_blob_name
+from storage import hash_stream_async, upload_stream_async, UploadTooLarge
+
+logger = logging.getLogger(__name__)
+
+# Maximum open connections to Blob Storage per process
+ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', 100))
+
+
+class AsyncAzureBlobBackend:
+    """Async counterpart of backends.AzureBlobBackend with pooled connections"""
+
+    def __init__(self, account_url, pool_size):
+        self.account_url = account_url
+        self.pool_size = pool_size
+        self.client = None
+        self._session = None
+        self._credential = None
+        self._containers = {}
+
+    async def open(self):
+        # The session must be created inside the running event loop
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size)
+        )
+        self._credential = DefaultAzureCredential()
+        self.client = BlobServiceClient(
+            account_url=self.account_url,
+            credential=self._credential,
+            transport=AioHttpTransport(session=self._session, session_owner=False),
+            raw_request_hook=core.blob_metrics.on_request,
+            raw_response_hook=core.blob_metrics.on_response
+        )
+
+    async def close(self):
+        await self.client.close()
+        await self._credential.close()
+        await self._session.close()
+
+    def _container(self, name):
+        container_client = self._containers.get(name)
+        if container_client is None:
+            container_client = self.client.get_container_client(name)
+            self._containers[name] = container_client
+        return container_client
+
+    def _blob(self, container, name):
+        return self._container(container).get_blob_client(name)
+
+    async def put(self, container, name, data, overwrite=True, content_type=None):
+        content_settings = ContentSettings(content_type=content_type) if content_type else None
+        try:
+            await self._blob(container, name).upload_blob(
+                data, overwrite=overwrite, content_settings=content_settings
+            )
+        except ResourceExistsError:
+            return False
+        return True
+
+    async def put_stream(self, container, name, stream, max_size):
+        return await upload_stream_async(
+            self._blob(container, name),
+            stream,
+            max_size,
+            block_size=core.UPLOAD_BLOCK_SIZE,
+            max_concurrency=core.UPLOAD_MAX_CONCURRENCY
+        )
+
+    async def get(self, container, name):
+        try:
+            downloader = await self._blob(container, name).download_blob()
+            return await downloader.readall()
+        except ResourceNotFoundError:
+            return None
+
+    async def exists(self, container, name):
+        return await self._blob(container, name).exists()
+
+    async def list(self, container, prefix=''):
+        async for blob in self._container(container).list_blobs(name_starts_with=prefix or None):
+            yield blob.name
+
+
+class AsyncBackendAdapter:
+    """Runs the operations of a local (sync) storage backend in the thread pool"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def put(self, container, name, data, overwrite=True, content_type=None):
+        return await run_in_threadpool(self.backend.put, container, name, data, overwrite, content_type)
+
+    async def put_stream(self, container, name, stream, max_size):
+        # Starlette spools uploads to a regular file object
+        return await run_in_threadpool(self.backend.put_stream, container, name, stream.file, max_size)
+
+    async def get(self, container, name):
+        return await run_in_threadpool(self.backend.get, container, name)
+
+    async def exists(self, container, name):
+        return await run_in_threadpool(self.backend.exists, container, name)
+
+    async def list(self, container, prefix=''):
+        names = await run_in_threadpool(lambda: list(self.backend.list(container, prefix)))
+        for name in names:
+            yield name
+
+
+if core.STORAGE_BACKEND == 'azure':
+    storage_backend = AsyncAzureBlobBackend(core.BLOB_ACCOUNT_URL, ASYNC_POOL_SIZE)
+else:
+    storage_backend = AsyncBackendAdapter(core.storage_backend)
+
+
+class SecurityHeadersMiddleware:
+    """Security: Add the same security headers as app.py"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).update(core.SECURITY_HEADERS)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class RequestTooLarge(Exception):
+    """Raised while reading a request body longer than MAX_CONTENT_LENGTH"""
+
+
+class BodySizeLimitMiddleware:
+    """Security: Stop reading request bodies past MAX_CONTENT_LENGTH.
+
+    Counts the bytes actually received, so chunked bodies without a
+    Content-Length are cut off too, like Flask's limit on the stream.
+    """
+
+    def __init__(self, app, max_size):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_size:
+                    raise RequestTooLarge(self.max_size)
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+
+class MetricsMiddleware:
+    """Record request latency per route, like the Flask request hooks in app.py"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            # Timed until the headers are sent, so event streams aren't
+            # recorded as slow requests
+            if message['type'] == 'http.response.start':
+                route = scope.get('route')
+                core.request_duration.observe(
+                    time.perf_counter() - start,
+                    scope['method'],
+                    route.path if route is not None else 'unmatched',
+                    str(message['status'])
+                )
+            await send(message)
+
+        core.requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            core.requests_in_progress.dec()
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse(core.health_response())
+
+
+async def find_duplicate(input_digest):
+    """Async counterpart of app.find_duplicate"""
+    entry = await run_in_threadpool(core.find_local_duplicate, input_digest)
+    if entry is None:
+        data = await storage_backend.get(core.INPUT_CONTAINER, core.input_index_blob_name(input_digest))
+        if data is None:
+            return None
+        entry = json.loads(data)
+        # Process the upload afresh, taking over the index, rather than wait on a dead job
+        status, _ = await lookup_result(entry["job_id"])
+        source = await run_in_threadpool(core.job_scheduler.store.get, entry["job_id"])
+        if core.index_entry_abandoned(entry, status, source):
+            return None
+    return entry
+
+
+async def record_input_digest(input_digest, job_id, filename, run_at):
+    """Async counterpart of app.record_input_digest"""
+    await storage_backend.put(core.INPUT_CONTAINER, core.input_index_blob_name(input_digest),
+                              core.input_index_entry(job_id, filename, run_at))
+
+
+async def upload_file(request):
+    """Upload CSV file to Azure Blob Storage and create hardcoded output"""
+    form = None
+    try:
+        # Security: Reject oversized request bodies before they are spooled
+        content_length = request.headers.get('content-length')
+        try:
+            content_length = int(content_length) if content_length else None
+        except ValueError:
+            return JSONResponse({"error": "Invalid Content-Length header"}, status_code=400)
+        if content_length is not None and content_length > core.app.config['MAX_CONTENT_LENGTH']:
+            return JSONResponse({"error": core.FILE_TOO_LARGE_ERROR}, status_code=400)
+
+        # Like Flask: an unparseable body has no file, and the first file part is used
+        try:
+            form = await request.form()
+        except HTTPException:
+            return JSONResponse({"error": "No file provided"}, status_code=400)
+        files = form.getlist('file')
+        file = files[0] if files else None
+        if not isinstance(file, UploadFile):
+            return JSONResponse({"error": "No file provided"}, status_code=400)
+        if not file.filename:
+            return JSONResponse({"error": "No file selected"}, status_code=400)
+
+        # Security: Validate file type and filename
+        error = core.validate_upload_filename(file.filename)
+        if error:
+            return JSONResponse({"error": error}, status_code=400)
+
+        # Backpressure: refuse new work while the job queue is full
+        if await run_in_threadpool(core.job_scheduler.is_full):
+            return JSONResponse({"error": core.SERVER_BUSY_ERROR}, status_code=503,
+                                headers={"Retry-After": "30"})
+
+        # Hash the spooled upload before anything is sent to storage
+        # Security: File size (max 10MB) is enforced while hashing
+        input_digest, file_size = await hash_stream_async(
+            file, core.MAX_UPLOAD_SIZE, core.UPLOAD_BLOCK_SIZE
+        )
+        # Duplicates must match on content and on the output the filename selects
+        input_digest = core.dedup_key(input_digest, file.filename)
+
+        # Generate unique ID
+        unique_id = str(uuid.uuid4())
+
+        # Identical content skips the blob write and processing
+        force = core.force_requested(form) or core.force_requested(request.query_params)
+        original = None if force else await find_duplicate(input_digest)
+        if original is not None:
+            await run_in_threadpool(
+                core.schedule_duplicate, unique_id, original, file.filename, input_digest, file_size
+            )
+            logger.info("Duplicate upload", extra={"job_id": unique_id, "source_job_id": original['job_id']})
+            return JSONResponse(core.upload_response(unique_id, original["filename"], original["job_id"]))
+
+        filename = f"{unique_id}.csv"
+
+        # Stream file to input container in blocks
+        upload_start = time.perf_counter()
+        await storage_backend.put_stream(core.INPUT_CONTAINER, filename, file, core.MAX_UPLOAD_SIZE)
+
+        core.record_upload(file_size, time.perf_counter() - upload_start)
+        logger.info("File uploaded", extra={"job_id": unique_id, "blob": filename, "size": file_size})
+
+        run_at = await run_in_threadpool(
+            core.schedule_processing, unique_id, filename, file.filename, input_digest, file_size
+        )
+        await record_input_digest(input_digest, unique_id, filename, run_at)
+
+        return JSONResponse(core.upload_response(unique_id, filename))
+
+    except (UploadTooLarge, RequestTooLarge):
+        return JSONResponse({"error": core.FILE_TOO_LARGE_ERROR}, status_code=400)
+    except QueueFull:
+        return JSONResponse({"error": core.SERVER_BUSY_ERROR}, status_code=503,
+                            headers={"Retry-After": "30"})
+    except Exception as e:
+        logger.exception("Upload error")
+        return JSONResponse({"error": f"Failed to upload file: {str(e)}"}, status_code=500)
+    finally:
+        if form is not None:
+            await form.close()
+
+
+async def download_output_blob(name):
+    """Download a blob from the output container, or None if it doesn't exist"""
+    return await storage_backend.get(core.OUTPUT_CONTAINER, name)
+
+
+async def load_payload(digest):
+    """Async counterpart of app.load_payload"""
+    payload = core.payload_registry.get(digest)
+    if payload is None:
+        data = await download_output_blob(payload_blob_name(digest))
+        if data is not None:
+            payload = core.payload_registry.add(Payload.from_gzip(data))
+    return payload
+
+
+async def lookup_result(job_id):
+    """Async counterpart of app.lookup_result"""
+    local = await run_in_threadpool(core.lookup_local_result, job_id)
+    if local is not None and local[0] != "stored":
+        core.result_lookups.inc(1, "local")
+        return local
+
+    core.result_lookups.inc(1, "storage")
+    if local is not None:
+        payload = await load_payload(local[1])
+    else:
+        # Follow the job's ref to its payload, falling back to a
+        # per-job JSON result written before payloads were shared
+        ref = await download_output_blob(ref_blob_name(job_id))
+        if ref is not None:
+            payload = await load_payload(ref.decode('utf-8'))
+        elif core.LEGACY_RESULTS:
+            data = await download_output_blob(f"{job_id}.json")
+            payload = core.payload_registry.add(Payload.from_json(data)) if data is not None else None
+        else:
+            payload = None
+
+    if payload is None:
+        core.result_cache.mark_pending(job_id)
+        return "pending", None
+    return "done", core.result_cache.put(job_id, payload)
+
+
+async def wait_for_result(job_id, timeout):
+    """Wait until a job finishes or ``timeout`` seconds pass"""
+    deadline = time.monotonic() + timeout
+    # Subscribe before checking so a completion in between isn't missed
+    with core.completion_hub.subscribe_async([job_id]) as subscription:
+        status, result = await lookup_result(job_id)
+        while status == "pending":
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Wake up periodically to notice jobs finished by other workers
+            await subscription.wait(min(remaining, core.COMPLETION_RECHECK_INTERVAL))
+            status, result = await lookup_result(job_id)
+    return status, result
+
+
+async def get_result(request):
+    """Get processing result, optionally long-polling with ?wait=<seconds>"""
+    job_id = request.path_params['job_id']
+    try:
+        try:
+            wait = min(float(request.query_params.get('wait', 0)), core.LONG_POLL_MAX_WAIT)
+        except ValueError:
+            wait = 0
+        if wait > 0:
+            status, result = await wait_for_result(job_id, wait)
+        else:
+            status, result = await lookup_result(job_id)
+
+        if status != "done":
+            return JSONResponse({"status": status})
+
+        status_code, body, headers = core.result_representation(
+            result,
+            request.headers.get('accept-encoding'),
+            request.headers.get('if-none-match')
+        )
+        return Response(body, status_code=status_code, headers=headers)
+
+    except Exception as e:
+        logger.exception("Result error", extra={"job_id": job_id})
+        return JSONResponse({"error": f"Failed to get result: {str(e)}"}, status_code=500)
+
+
+async def job_events(request):
+    """Stream completion of one or more jobs as Server-Sent Events"""
+    job_ids, error = core.parse_event_job_ids(request.query_params)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+
+    async def stream():
+        remaining = set(job_ids)
+        deadline = time.monotonic() + core.SSE_MAX_DURATION
+        last_sent = time.monotonic()
+        # Subscribe before checking so a completion in between isn't missed
+        with core.completion_hub.subscribe_async(job_ids) as subscription:
+            to_check = set(remaining)
+            while True:
+                for job_id in to_check & remaining:
+                    try:
+                        status, result = await lookup_result(job_id)
+                    except Exception:
+                        logger.exception("Event stream error", extra={"job_id": job_id})
+                        continue
+                    if status == "pending":
+                        continue
+                    remaining.discard(job_id)
+                    last_sent = time.monotonic()
+                    yield core.completion_event(job_id, status, result)
+
+                now = time.monotonic()
+                if not remaining or now >= deadline:
+                    break
+                if now - last_sent >= core.SSE_HEARTBEAT_INTERVAL:
+                    last_sent = now
+                    yield ": keep-alive\n\n"
+
+                to_check = await subscription.wait(min(
+                    deadline - now,
+                    core.COMPLETION_RECHECK_INTERVAL,
+                    core.SSE_HEARTBEAT_INTERVAL
+                ))
+                # Nothing signalled in this process, re-check everything
+                if not to_check:
+                    to_check = set(remaining)
+
+        if remaining:
+            yield core.sse_event("timeout", {"pending": sorted(remaining)})
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+async def list_jobs(request):
+    """List uploaded jobs, newest first, one page at a time"""
+    if not core.listing_authorized(request.headers.get('authorization')):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    body, error = await run_in_threadpool(core.jobs_listing, request.query_params)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    return JSONResponse(body)
+
+
+async def list_results(request):
+    """List finished results, newest first, one page at a time"""
+    if not core.listing_authorized(request.headers.get('authorization')):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    body, error = await run_in_threadpool(core.results_listing, request.query_params)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    return JSONResponse(body)
+
+
+async def metrics(request):
+    """Prometheus metrics for this process"""
+    if not core.metrics_authorized(request.headers.get('authorization')):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    return Response(core.metrics_registry.render(),
+                    headers={'Content-Type': core.METRICS_CONTENT_TYPE})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await storage_backend.open()
+    try:
+        yield
+    finally:
+        await storage_backend.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/upload', upload_file, methods=['POST']),
+        Route('/api/result/{job_id}', get_result, methods=['GET']),
+        Route('/api/events', job_events, methods=['GET']),
+        Route('/api/jobs', list_jobs, methods=['GET']),
+        Route('/api/results', list_results, methods=['GET']),
+        Route('/api/metrics', metrics, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(MetricsMiddleware),
+        # Security: Restrict CORS to specific origins
+        Middleware(CORSMiddleware, allow_origins=core.CORS_ORIGINS,
+                   allow_methods=['*'], allow_headers=['*']),
+        Middleware(SecurityHeadersMiddleware),
+        Middleware(BodySizeLimitMiddleware, max_size=core.app.config['MAX_CONTENT_LENGTH']),
+    ],
+    lifespan=lifespan
+)
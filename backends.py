@@ -0,0 +1,263 @@
+"""Storage backends for uploaded files and results.
+
+The app only needs a handful of blob operations, grouped here behind one
+interface so the Azure Blob Storage backend can be swapped for a local
+one in development and benchmarks.
+"""
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.identity import DefaultAzureCredential
+from azure.storage.blob import BlobServiceClient, ContentSettings
+
+from storage import DEFAULT_BLOCK_SIZE, UploadTooLarge, upload_stream
+
+
+class StorageBackend(ABC):
+    """Blob operations used by the app, addressed by container and blob name"""
+
+    @abstractmethod
+    def put(self, container, name, data, overwrite=True, content_type=None):
+        """Store ``data``. Returns False if the blob exists and ``overwrite`` is False."""
+
+    @abstractmethod
+    def put_stream(self, container, name, stream, max_size):
+        """Store a file-like object, raising UploadTooLarge past ``max_size``.
+
+        Returns the number of bytes written.
+        """
+
+    @abstractmethod
+    def get(self, container, name):
+        """Return the blob's contents, or None if it doesn't exist"""
+
+    @abstractmethod
+    def exists(self, container, name):
+        """Whether the blob exists"""
+
+    @abstractmethod
+    def delete(self, container, name):
+        """Remove a blob, if it exists"""
+
+    @abstractmethod
+    def list(self, container, prefix=''):
+        """Yield the names of blobs starting with ``prefix``, in name order"""
+
+
+def read_limited(stream, max_size, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield chunks of ``stream``, raising UploadTooLarge past ``max_size``"""
+    total = 0
+    for data in iter(lambda: stream.read(block_size), b''):
+        total += len(data)
+        if total > max_size:
+            raise UploadTooLarge(max_size)
+        yield data
+
+
+class AzureBlobBackend(StorageBackend):
+    """Azure Blob Storage, authenticated with DefaultAzureCredential.
+
+    The client is created on first use, so importing the app doesn't wait
+    on credential discovery. ``client_options`` are passed to
+    BlobServiceClient.
+    """
+
+    def __init__(self, account_url, executor, block_size=DEFAULT_BLOCK_SIZE,
+                 max_concurrency=4, **client_options):
+        self.account_url = account_url
+        self.executor = executor
+        self.block_size = block_size
+        self.max_concurrency = max_concurrency
+        self.client_options = client_options
+        self._client = None
+        self._containers = {}
+        self._lock = threading.Lock()
+
+    def _container(self, name):
+        # Container clients are reused across requests
+        container_client = self._containers.get(name)
+        if container_client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = BlobServiceClient(
+                        account_url=self.account_url,
+                        credential=DefaultAzureCredential(),
+                        **self.client_options
+                    )
+                container_client = self._containers.setdefault(
+                    name, self._client.get_container_client(name)
+                )
+        return container_client
+
+    def _blob(self, container, name):
+        return self._container(container).get_blob_client(name)
+
+    def put(self, container, name, data, overwrite=True, content_type=None):
+        content_settings = ContentSettings(content_type=content_type) if content_type else None
+        try:
+            self._blob(container, name).upload_blob(
+                data, overwrite=overwrite, content_settings=content_settings
+            )
+        except ResourceExistsError:
+            return False
+        return True
+
+    def put_stream(self, container, name, stream, max_size):
+        return upload_stream(
+            self._blob(container, name),
+            stream,
+            max_size,
+            self.executor,
+            block_size=self.block_size,
+            max_concurrency=self.max_concurrency
+        )
+
+    def get(self, container, name):
+        try:
+            return self._blob(container, name).download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+
+    def exists(self, container, name):
+        return self._blob(container, name).exists()
+
+    def delete(self, container, name):
+        try:
+            self._blob(container, name).delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+    def list(self, container, prefix=''):
+        for blob in self._container(container).list_blobs(name_starts_with=prefix or None):
+            yield blob.name
+
+
+class FileSystemBackend(StorageBackend):
+    """Blobs stored as files under ``root/<container>/<name>``.
+
+    Writes go to a temporary file that is renamed into place, so readers
+    never see a partial blob.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, container, name):
+        # Security: Blob names come partly from request paths
+        path = os.path.abspath(os.path.join(self.root, container, name))
+        if not path.startswith(os.path.join(self.root, container) + os.sep):
+            raise ValueError(f"Invalid blob name: {name}")
+        return path
+
+    def _write(self, path, chunks, overwrite):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                for data in chunks:
+                    f.write(data)
+                    size += len(data)
+            if overwrite:
+                os.replace(tmp_path, path)
+            else:
+                # link() fails if the blob exists, unlike rename()
+                try:
+                    os.link(tmp_path, path)
+                except FileExistsError:
+                    return None
+                finally:
+                    os.unlink(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return size
+
+    def put(self, container, name, data, overwrite=True, content_type=None):
+        return self._write(self._path(container, name), [data], overwrite) is not None
+
+    def put_stream(self, container, name, stream, max_size):
+        return self._write(self._path(container, name), read_limited(stream, max_size), True)
+
+    def _existing_path(self, container, name):
+        # Names that would escape the container can't exist
+        try:
+            return self._path(container, name)
+        except ValueError:
+            return None
+
+    def get(self, container, name):
+        path = self._existing_path(container, name)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    def exists(self, container, name):
+        path = self._existing_path(container, name)
+        return path is not None and os.path.isfile(path)
+
+    def delete(self, container, name):
+        path = self._existing_path(container, name)
+        if path is not None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def list(self, container, prefix=''):
+        container_root = os.path.join(self.root, container)
+        names = []
+        for directory, _, files in os.walk(container_root):
+            relative = os.path.relpath(directory, container_root)
+            for filename in files:
+                if filename.startswith('.tmp-'):
+                    continue
+                name = filename if relative == '.' else f"{relative}/{filename}".replace(os.sep, '/')
+                if name.startswith(prefix):
+                    names.append(name)
+        yield from sorted(names)
+
+
+class MemoryBackend(StorageBackend):
+    """Blobs kept in a dict for the life of the process"""
+
+    def __init__(self):
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, container, name, data, overwrite=True, content_type=None):
+        with self._lock:
+            if not overwrite and (container, name) in self._blobs:
+                return False
+            self._blobs[(container, name)] = bytes(data)
+        return True
+
+    def put_stream(self, container, name, stream, max_size):
+        data = b''.join(read_limited(stream, max_size))
+        self.put(container, name, data)
+        return len(data)
+
+    def get(self, container, name):
+        with self._lock:
+            return self._blobs.get((container, name))
+
+    def exists(self, container, name):
+        with self._lock:
+            return (container, name) in self._blobs
+
+    def delete(self, container, name):
+        with self._lock:
+            self._blobs.pop((container, name), None)
+
+    def list(self, container, prefix=''):
+        with self._lock:
+            names = sorted(n for c, n in self._blobs if c == container and n.startswith(prefix))
+        yield from names
@@ -0,0 +1,316 @@
+"""Load test for /api/upload and /api/result against a local storage backend.
+
+Starts the API in a subprocess (Gunicorn for the Flask app, Uvicorn for
+the ASGI app) with the in-memory or filesystem storage backend and no
+simulated processing delay, then:
+
+1. uploads ``--uploads`` distinct files with ``--concurrency`` clients,
+2. waits for every job to finish (not timed),
+3. fetches ``--results`` results of randomly chosen jobs, gzip accepted.
+
+Each phase reports throughput and p50/p99/max latency, followed by the
+server's memory use. Runs are reproducible for a given ``--seed``. Save a
+run with ``--json`` and pass it as ``--baseline`` to a later run to fail
+(exit status 1) when throughput drops or p99 latency grows by more than
+``--max-regression``. A baseline recorded with different settings is
+refused (exit status 2), as its numbers aren't comparable.
+
+Usage:
+    python benchmarks/load_test.py --backend memory --server flask
+    python benchmarks/load_test.py --json baseline.json
+    python benchmarks/load_test.py --baseline baseline.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Arguments that change what is measured; runs only compare if they match
+CONFIG_ARGS = ('server', 'backend', 'uploads', 'results', 'concurrency', 'file_size', 'seed')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir, port):
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND=args.backend,
+        STORAGE_PATH=os.path.join(workdir, 'storage'),
+        JOB_DB_PATH=os.path.join(workdir, 'jobs.db'),
+        PROCESSING_DELAY_MIN='0',
+        PROCESSING_DELAY_MAX='0',
+        MAX_PENDING_JOBS=str(args.uploads + 1000),
+        LOG_LEVEL='WARNING'
+    )
+    # One worker process: the in-memory backend and the job table are
+    # per process, and it keeps memory figures comparable between runs
+    if args.server == 'flask':
+        command = [sys.executable, '-m', 'gunicorn', '-w', '1', '-k', 'gthread',
+                   '--threads', str(args.concurrency), '-b', f'127.0.0.1:{port}',
+                   '--log-level', 'warning', 'app:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1',
+                   '--port', str(port), '--log-level', 'warning']
+    server = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+
+def process_memory(pid):
+    """Return (rss, peak rss) in bytes of a process and its children, or None off Linux"""
+    rss = peak = 0
+    pending = [pid]
+    try:
+        while pending:
+            pid = pending.pop()
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+                    elif line.startswith('VmHWM:'):
+                        peak += int(line.split()[1]) * 1024
+            with open(f'/proc/{pid}/task/{pid}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+    except OSError:
+        return None
+    return rss, peak
+
+
+class Client:
+    """One keep-alive connection per benchmark thread"""
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.local.conn = None
+            raise
+
+
+def run_phase(client, requests, concurrency):
+    """Send ``requests`` (method, path, body, headers, check) and time each one"""
+    latencies = []
+    errors = 0
+    responses = []
+    lock = threading.Lock()
+
+    def send(spec):
+        nonlocal errors
+        method, path, body, headers, check = spec
+        start = time.perf_counter()
+        try:
+            status, data = client.request(method, path, body, headers)
+            ok = check(status, data)
+        except Exception:
+            data, ok = None, False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if ok:
+                responses.append(data)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, requests))
+    duration = time.perf_counter() - start
+    return summarize(latencies, errors, duration), responses
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, duration):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / duration if duration else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000
+    }
+
+
+def upload_request(index, content):
+    boundary = f'benchmark-{index:08d}'
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="bench-{index}.csv"\r\n'
+        f'Content-Type: text/csv\r\n\r\n'
+    ).encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    return 'POST', '/api/upload', body, headers, lambda status, data: status == 200
+
+
+def upload_contents(args):
+    """Distinct, reproducible file contents, so uploads aren't deduplicated"""
+    rng = random.Random(args.seed)
+    filler = bytes(rng.choice(b'abcdefghij,0123456789\n') for _ in range(args.file_size))
+    for index in range(args.uploads):
+        header = f'upload,{index}\n'.encode('utf-8')
+        yield index, header + filler[len(header):]
+
+
+def run_config(args):
+    return {name: getattr(args, name) for name in CONFIG_ARGS}
+
+
+def config_differences(args, baseline):
+    """List the settings ``baseline`` was recorded with that differ from ``args``"""
+    config = baseline.get('config', {})
+    return [f"{name}={config.get(name)} (this run: {value})"
+            for name, value in run_config(args).items() if config.get(name) != value]
+
+
+def run(args):
+    results = {'config': run_config(args)}
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        server = start_server(args, workdir, port)
+        try:
+            client = Client(port)
+
+            requests = [upload_request(index, content) for index, content in upload_contents(args)]
+            results['upload'], responses = run_phase(client, requests, args.concurrency)
+            job_ids = [json.loads(data)['job_id'] for data in responses]
+
+            # Jobs run with no delay; wait for them before timing results
+            def is_done(status, data):
+                return status == 200 and json.loads(data).get('status') != 'pending'
+            waits = [('GET', f'/api/result/{job_id}?wait=30', None, {}, is_done) for job_id in job_ids]
+            run_phase(client, waits, args.concurrency)
+
+            rng = random.Random(args.seed)
+            gzip_headers = {'Accept-Encoding': 'gzip'}
+            requests = [
+                ('GET', f'/api/result/{rng.choice(job_ids)}', None, gzip_headers,
+                 lambda status, data: status == 200)
+                for _ in range(args.results if job_ids else 0)
+            ]
+            results['result'], _ = run_phase(client, requests, args.concurrency)
+
+            memory = process_memory(server.pid)
+            if memory is not None:
+                results['memory'] = {"rss_mb": memory[0] / 2 ** 20, "peak_rss_mb": memory[1] / 2 ** 20}
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def report(args, results):
+    print(f"server={args.server} backend={args.backend} concurrency={args.concurrency} "
+          f"uploads={args.uploads} results={args.results} file_size={args.file_size}")
+    print(f"{'phase':<8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for phase in ('upload', 'result'):
+        stats = results[phase]
+        print(f"{phase:<8} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput']:>9.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+    memory = results.get('memory')
+    if memory:
+        print(f"server memory: rss {memory['rss_mb']:.1f} MB, peak {memory['peak_rss_mb']:.1f} MB")
+    else:
+        print("server memory: not available on this platform")
+
+
+def regressions(results, baseline, tolerance):
+    """List the ways ``results`` is worse than ``baseline`` beyond ``tolerance``"""
+    found = []
+    for phase in ('upload', 'result'):
+        current, previous = results[phase], baseline.get(phase)
+        if not previous:
+            continue
+        if current['throughput'] < previous['throughput'] * (1 - tolerance):
+            found.append(f"{phase} throughput {current['throughput']:.1f} req/s "
+                         f"(baseline {previous['throughput']:.1f})")
+        if current['p99_ms'] > previous['p99_ms'] * (1 + tolerance):
+            found.append(f"{phase} p99 {current['p99_ms']:.2f} ms (baseline {previous['p99_ms']:.2f})")
+        if current['errors'] > previous['errors']:
+            found.append(f"{phase} errors {current['errors']} (baseline {previous['errors']})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--backend', choices=('memory', 'filesystem'), default='memory')
+    parser.add_argument('--uploads', type=int, default=500)
+    parser.add_argument('--results', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='bytes per uploaded file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed fractional drop in throughput or rise in p99 (default: 0.2)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differences = config_differences(args, baseline)
+        if differences:
+            print(f"Baseline {args.baseline} was recorded with different settings: "
+                  + ', '.join(differences), file=sys.stderr)
+            sys.exit(2)
+
+    results = run(args)
+    report(args, results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.max_regression)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
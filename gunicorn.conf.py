@@ -0,0 +1,16 @@
+"""Gunicorn settings for production: gunicorn -c gunicorn.conf.py app:app
+
+Long polls (``/api/result?wait=``) and event streams (``/api/events``) hold
+a request open for up to LONG_POLL_MAX_WAIT/SSE_MAX_DURATION seconds. Sync
+workers are killed once a request runs past ``timeout``, taking any
+running jobs with them, so threaded workers are required: their heartbeat
+doesn't depend on requests finishing.
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_class = 'gthread'
+# Each waiting client holds a thread
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+timeout = 60
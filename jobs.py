@@ -0,0 +1,478 @@
+"""Background job scheduling backed by a SQLite job table"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    run_at REAL NOT NULL,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_run_at ON jobs (status, run_at);
+"""
+
+# Columns added after the original schema, created on startup if missing
+COLUMNS = [
+    ('result', 'TEXT'),
+    ('input_digest', 'TEXT'),
+    ('source_job_id', 'TEXT'),
+    ('size', 'INTEGER'),
+    ('finished_at', 'REAL'),
+    ('result_size', 'INTEGER'),
+]
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_input_digest ON jobs (input_digest);
+CREATE INDEX IF NOT EXISTS jobs_source_job_id ON jobs (source_job_id);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at, job_id);
+CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs (status, created_at, job_id);
+CREATE INDEX IF NOT EXISTS jobs_status_finished_at ON jobs (status, finished_at, job_id);
+"""
+
+# Time columns jobs can be listed by, newest first
+LIST_ORDERS = ('created_at', 'finished_at')
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are waiting to be processed"""
+
+
+class Retry(Exception):
+    """Raised by a handler to run the job again later without using up an attempt"""
+
+    def __init__(self, delay):
+        super().__init__(f"Retry in {delay} seconds")
+        self.delay = delay
+
+
+class JobStore:
+    """Durable job table shared by every worker process on the host.
+
+    Each thread gets its own connection; the database runs in WAL mode so
+    readers never block the writer. Claims are conditional updates, so a
+    job is only ever handed to one worker even across processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        existing = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for name, column_type in COLUMNS:
+            if name not in existing:
+                try:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {name} {column_type}')
+                except sqlite3.OperationalError:
+                    # Another worker process added it first
+                    pass
+                if name == 'finished_at':
+                    # Jobs finished before the column existed last changed when they finished
+                    conn.execute('UPDATE jobs SET finished_at = updated_at '
+                                 'WHERE finished_at IS NULL AND status IN (?, ?)', (DONE, FAILED))
+        conn.executescript(INDEXES)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, job_id, payload, run_at, max_pending=None, status=QUEUED, result=None,
+            input_digest=None, source_job_id=None, size=None, result_size=None):
+        """Insert a job, enforcing the pending job limit"""
+        now = time.time()
+        finished_at = now if status in (DONE, FAILED) else None
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if max_pending is not None and self.pending_count(conn) >= max_pending:
+                raise QueueFull(f"{max_pending} jobs already pending")
+            conn.execute(
+                'INSERT INTO jobs (job_id, status, payload, run_at, result, input_digest, '
+                'source_job_id, size, result_size, created_at, updated_at, finished_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, status, json.dumps(payload), run_at, result, input_digest,
+                 source_job_id, size, result_size, now, now, finished_at)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get(self, job_id):
+        row = self._conn().execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_input_digest(self, input_digest):
+        """Most recent job, other than failed ones, that processed this input"""
+        row = self._conn().execute(
+            'SELECT * FROM jobs WHERE input_digest = ? AND source_job_id IS NULL AND status != ? '
+            'ORDER BY created_at DESC LIMIT 1',
+            (input_digest, FAILED)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def waiting_on(self, source_job_id):
+        """IDs of unfinished jobs reusing the result of ``source_job_id``"""
+        rows = self._conn().execute(
+            'SELECT job_id FROM jobs WHERE source_job_id = ? AND status IN (?, ?)',
+            (source_job_id, QUEUED, RUNNING)
+        ).fetchall()
+        return [row['job_id'] for row in rows]
+
+    def next_run_at(self):
+        """Earliest run time of any queued job, or None"""
+        row = self._conn().execute(
+            'SELECT MIN(run_at) FROM jobs WHERE status = ?', (QUEUED,)
+        ).fetchone()
+        return row[0]
+
+    def claim_due(self, limit, lease):
+        """Move up to ``limit`` due jobs to running and return them"""
+        now = time.time()
+        conn = self._conn()
+        rows = conn.execute(
+            'SELECT job_id FROM jobs WHERE status = ? AND run_at <= ? ORDER BY run_at LIMIT ?',
+            (QUEUED, now, limit)
+        ).fetchall()
+        claimed = []
+        for row in rows:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? '
+                'WHERE job_id = ? AND status = ?',
+                (RUNNING, now + lease, now, row['job_id'], QUEUED)
+            )
+            # Another worker may have claimed it first
+            if cursor.rowcount:
+                claimed.append(self.get(row['job_id']))
+        return claimed
+
+    def finish(self, job_id, status, error=None, result=None, result_size=None):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            'UPDATE jobs SET status = ?, error = ?, result = ?, result_size = ?, lease_until = NULL, '
+            'updated_at = ?, finished_at = ? WHERE job_id = ?',
+            (status, error, result, result_size, now, now, job_id)
+        )
+
+    def page(self, limit, order_by='created_at', status=None, since=None, until=None, after=None):
+        """List jobs newest first by ``order_by``, then job_id.
+
+        ``since``/``until`` bound ``order_by``, and ``after`` is the
+        (``order_by`` value, job_id) of the last job on the previous page.
+        Each combination of filters is served by an index range scan, so a
+        page costs the same however many jobs there are.
+        """
+        if order_by not in LIST_ORDERS:
+            raise ValueError(f"Cannot list jobs by {order_by}")
+        clauses, params = [f'{order_by} IS NOT NULL'], []
+        if status is not None:
+            clauses.append('status = ?')
+            params.append(status)
+        if since is not None:
+            clauses.append(f'{order_by} >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append(f'{order_by} < ?')
+            params.append(until)
+        if after is not None:
+            clauses.append(f'({order_by}, job_id) < (?, ?)')
+            params.extend(after)
+        rows = self._conn().execute(
+            f'SELECT * FROM jobs WHERE {" AND ".join(clauses)} '
+            f'ORDER BY {order_by} DESC, job_id DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def take_over(self, job_id, source_job_id):
+        """Have a duplicate job process its input itself instead of reusing
+        ``source_job_id``, and hand it the jobs still waiting on the source"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('UPDATE jobs SET source_job_id = NULL, updated_at = ? WHERE job_id = ?',
+                         (time.time(), job_id))
+            conn.execute(
+                'UPDATE jobs SET source_job_id = ? WHERE source_job_id = ? AND status IN (?, ?)',
+                (job_id, source_job_id, QUEUED, RUNNING)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def retry(self, job_id, run_at, error):
+        conn = self._conn()
+        conn.execute(
+            'UPDATE jobs SET status = ?, run_at = ?, error = ?, lease_until = NULL, updated_at = ? '
+            'WHERE job_id = ?',
+            (QUEUED, run_at, error, time.time(), job_id)
+        )
+
+    def defer(self, job_id, run_at):
+        """Requeue a running job without counting the attempt"""
+        self._conn().execute(
+            'UPDATE jobs SET status = ?, run_at = ?, attempts = attempts - 1, lease_until = NULL, '
+            'updated_at = ? WHERE job_id = ?',
+            (QUEUED, run_at, time.time(), job_id)
+        )
+
+    def recover_expired(self):
+        """Requeue running jobs whose worker died before finishing them"""
+        now = time.time()
+        cursor = self._conn().execute(
+            'UPDATE jobs SET status = ?, run_at = ?, lease_until = NULL, updated_at = ? '
+            'WHERE status = ? AND lease_until < ?',
+            (QUEUED, now, now, RUNNING, now)
+        )
+        return cursor.rowcount
+
+    def pending_counts(self):
+        """Queued and running jobs by status, counted on the status index so
+        the cost doesn't grow with the history of finished jobs"""
+        conn = self._conn()
+        return {
+            status: conn.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (status,)).fetchone()[0]
+            for status in (QUEUED, RUNNING)
+        }
+
+    def pending_count(self, conn=None):
+        """Number of jobs that are queued or running"""
+        row = (conn or self._conn()).execute(
+            'SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+        ).fetchone()
+        return row[0]
+
+
+class BlobJournal:
+    """Copy of each unfinished job kept in blob storage.
+
+    Lets a host whose job table is on ephemeral disk pick its queued jobs
+    up again after a restart. Jobs are recorded when submitted and removed
+    when they finish. A host adopts its own journaled jobs, and another
+    host's once they are ``grace`` seconds overdue, as that host is gone.
+    """
+
+    def __init__(self, backend, container, host, prefix='jobs/', grace=3600):
+        self.backend = backend
+        self.container = container
+        self.host = host
+        self.prefix = prefix
+        self.grace = grace
+
+    def record(self, job_id, payload, run_at, columns):
+        entry = {"host": self.host, "payload": payload, "run_at": run_at, "columns": columns}
+        self.backend.put(self.container, f"{self.prefix}{job_id}", json.dumps(entry).encode('utf-8'))
+
+    def remove(self, job_id):
+        self.backend.delete(self.container, f"{self.prefix}{job_id}")
+
+    def adoptable(self):
+        """Yield (job_id, entry) for journaled jobs this host should run"""
+        for name in self.backend.list(self.container, self.prefix):
+            data = self.backend.get(self.container, name)
+            if data is None:
+                continue
+            entry = json.loads(data)
+            if entry['host'] == self.host or time.time() > entry['run_at'] + self.grace:
+                yield name[len(self.prefix):], entry
+
+
+class JobScheduler:
+    """Runs due jobs from a JobStore on a bounded pool of worker threads.
+
+    A single scheduler thread sleeps until the next job is due (or until
+    it is woken by a new submission) and hands claimed jobs to the pool.
+    Pending jobs live only in the store, so thread count and memory stay
+    flat however many uploads are waiting.
+    """
+
+    def __init__(self, store, handler, workers=4, max_pending=1000, max_attempts=3,
+                 lease=300, poll_interval=5, on_failed=None, on_finished=None, journal=None,
+                 adopt_interval=300):
+        self.store = store
+        self.handler = handler
+        # Optional BlobJournal mirroring unfinished jobs, checked every adopt_interval seconds
+        self.journal = journal
+        self.adopt_interval = adopt_interval
+        # Called with the job ID once a job has used up its attempts
+        self.on_failed = on_failed
+        # Called with the job ID and final status of every job finished here
+        self.on_finished = on_finished
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.lease = lease
+        # Upper bound on sleep so jobs queued by other processes are picked up
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._wakeup = threading.Condition()
+        self._running = 0
+        self._thread = None
+        self._stopped = False
+        self._notified = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='job-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wake()
+        self._executor.shutdown(wait=False)
+
+    def submit(self, job_id, payload, delay=0, **columns):
+        """Queue a job to run after ``delay`` seconds. Raises QueueFull.
+
+        Extra keyword arguments are stored in the matching job table columns.
+        """
+        run_at = time.time() + delay
+        self.store.add(job_id, payload, run_at, max_pending=self.max_pending, **columns)
+        if self.journal is not None:
+            try:
+                self.journal.record(job_id, payload, run_at, columns)
+            except Exception:
+                logger.exception("Could not journal job", extra={"job_id": job_id})
+        with self._wakeup:
+            self._wake()
+
+    def finish(self, job_id, status, error=None, **columns):
+        """Record a job's outcome and drop it from the journal"""
+        self.store.finish(job_id, status, error, **columns)
+        if self.on_finished is not None:
+            self.on_finished(job_id, status)
+        if self.journal is not None:
+            try:
+                self.journal.remove(job_id)
+            except Exception:
+                logger.exception("Could not remove journaled job", extra={"job_id": job_id})
+
+    def adopt(self):
+        """Queue journaled jobs missing from the job table. Returns how many."""
+        adopted = 0
+        for job_id, entry in self.journal.adoptable():
+            try:
+                self.store.add(job_id, entry['payload'], entry['run_at'], **entry['columns'])
+            except sqlite3.IntegrityError:
+                # Already in the table, or adopted by another worker process;
+                # drop entries whose removal failed when the job finished
+                job = self.store.get(job_id)
+                if job is not None and job['status'] in (DONE, FAILED):
+                    self.journal.remove(job_id)
+                continue
+            if entry['host'] != self.journal.host:
+                self.journal.record(job_id, entry['payload'], entry['run_at'], entry['columns'])
+            adopted += 1
+        return adopted
+
+    def is_full(self):
+        return self.store.pending_count() >= self.max_pending
+
+    def in_flight(self):
+        return self._running
+
+    def _loop(self):
+        next_recovery = 0
+        next_adoption = 0
+        while True:
+            with self._wakeup:
+                if self._stopped:
+                    return
+            try:
+                now = time.time()
+                if now >= next_recovery:
+                    recovered = self.store.recover_expired()
+                    if recovered:
+                        logger.warning("Recovered interrupted jobs", extra={"recovered": recovered})
+                    next_recovery = now + self.poll_interval
+                if self.journal is not None and now >= next_adoption:
+                    # Storage being unavailable mustn't stop local jobs running
+                    next_adoption = now + self.adopt_interval
+                    try:
+                        adopted = self.adopt()
+                    except Exception:
+                        logger.exception("Could not adopt journaled jobs")
+                    else:
+                        if adopted:
+                            logger.warning("Adopted journaled jobs", extra={"adopted": adopted})
+                free = self.workers - self._running
+                if free > 0:
+                    for job in self.store.claim_due(free, self.lease):
+                        self._dispatch(job)
+                next_run_at = self.store.next_run_at()
+            except Exception:
+                logger.exception("Scheduler error")
+                next_run_at = None
+
+            if self._running >= self.workers:
+                # Woken by a worker finishing
+                timeout = self.poll_interval
+            elif next_run_at is not None:
+                timeout = min(self.poll_interval, next_run_at - time.time())
+            else:
+                timeout = self.poll_interval
+            with self._wakeup:
+                if not self._stopped and not self._notified and timeout > 0:
+                    self._wakeup.wait(timeout)
+                self._notified = False
+
+    def _dispatch(self, job):
+        with self._wakeup:
+            self._running += 1
+        self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        job_id = job['job_id']
+        try:
+            # Handlers may return a short string to record as the job result,
+            # or a dict of result columns to pass to finish()
+            result = self.handler(job_id, json.loads(job['payload']))
+            columns = result if isinstance(result, dict) else {'result': result}
+            self.finish(job_id, DONE, **columns)
+        except Retry as e:
+            self.store.defer(job_id, time.time() + e.delay)
+        except Exception as e:
+            logger.exception("Job failed", extra={"job_id": job_id, "attempt": job['attempts']})
+            if job['attempts'] < self.max_attempts:
+                backoff = 2 ** job['attempts'] * 5
+                self.store.retry(job_id, time.time() + backoff, str(e))
+            else:
+                self.finish(job_id, FAILED, str(e))
+                if self.on_failed is not None:
+                    self.on_failed(job_id)
+        finally:
+            with self._wakeup:
+                self._running -= 1
+                self._wake()
+
+    def _wake(self):
+        # Caller holds self._wakeup
+        self._notified = True
+        self._wakeup.notify()
@@ -0,0 +1,194 @@
+"""Minimal in-process metrics with Prometheus text exposition"""
+import bisect
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+# Latency buckets in seconds, from fast cache hits to slow blob calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Counter:
+    """Monotonically increasing value per label set"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge:
+    """Current value per label set.
+
+    Either set with ``inc``/``dec``, or sampled at scrape time from
+    ``callback``, which returns a number or a dict mapping label value
+    tuples to numbers.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def samples(self):
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Bucketed distribution of observed values per label set"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        # Only the matching bucket is incremented; samples() accumulates
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = (('le', _format_value(float(bound))),)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def blob_operation(method, url):
+    """Name the Blob Storage operation behind an HTTP request"""
+    query = parse_qs(urlsplit(url).query)
+    comp = query.get('comp', [''])[0]
+    if method == 'PUT':
+        return {'block': 'stage_block', 'blocklist': 'commit_block_list'}.get(comp, 'upload')
+    if method == 'GET':
+        return 'list' if comp == 'list' else 'download'
+    if method == 'HEAD':
+        return 'exists'
+    return method.lower()
+
+
+class BlobMetrics:
+    """Times every HTTP call made by a Blob Storage client.
+
+    Pass ``on_request`` and ``on_response`` to the client as its
+    ``raw_request_hook`` and ``raw_response_hook``; both the sync and the
+    async clients call them. Error responses are counted by status code.
+    """
+
+    def __init__(self, durations, errors):
+        self.durations = durations
+        self.errors = errors
+
+    def on_request(self, request):
+        request.context['metrics_start'] = time.perf_counter()
+
+    def on_response(self, response):
+        start = response.context.get('metrics_start')
+        if start is None:
+            return
+        http_request = response.http_request
+        operation = blob_operation(http_request.method, http_request.url)
+        self.durations.observe(time.perf_counter() - start, operation)
+        status = response.http_response.status_code
+        if status >= 400:
+            self.errors.inc(1, operation, str(status))
@@ -0,0 +1,104 @@
+"""In-process job completion notifications"""
+import asyncio
+import queue
+import threading
+
+
+class Subscription:
+    """A set of job IDs a request is waiting on"""
+
+    def __init__(self, hub, job_ids):
+        self.hub = hub
+        self.job_ids = set(job_ids)
+        self._queue = queue.SimpleQueue()
+
+    def wait(self, timeout):
+        """Return the IDs completed since the last call, waiting up to ``timeout`` seconds"""
+        try:
+            completed = {self._queue.get(timeout=timeout)}
+        except queue.Empty:
+            return set()
+        while True:
+            try:
+                completed.add(self._queue.get_nowait())
+            except queue.Empty:
+                return completed
+
+    def close(self):
+        self.hub._unsubscribe(self)
+
+    def _put(self, job_id):
+        self._queue.put(job_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncSubscription(Subscription):
+    """A Subscription awaited from an event loop instead of a thread"""
+
+    def __init__(self, hub, job_ids, loop):
+        super().__init__(hub, job_ids)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+
+    async def wait(self, timeout):
+        """Return the IDs completed since the last call, waiting up to ``timeout`` seconds"""
+        try:
+            completed = {await asyncio.wait_for(self._queue.get(), timeout)}
+        except asyncio.TimeoutError:
+            return set()
+        while not self._queue.empty():
+            completed.add(self._queue.get_nowait())
+        return completed
+
+    def _put(self, job_id):
+        # Completions are signalled from worker threads
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, job_id)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+
+class CompletionHub:
+    """Wakes request threads when a job they are watching finishes.
+
+    Only completions in this process are signalled; waiters should still
+    re-check job state periodically to see jobs finished elsewhere.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, job_ids):
+        return self._register(Subscription(self, job_ids))
+
+    def subscribe_async(self, job_ids):
+        """Subscribe from a coroutine running on the current event loop"""
+        return self._register(AsyncSubscription(self, job_ids, asyncio.get_running_loop()))
+
+    def _register(self, subscription):
+        with self._lock:
+            for job_id in subscription.job_ids:
+                self._subscribers.setdefault(job_id, set()).add(subscription)
+        return subscription
+
+    def notify(self, job_id):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(job_id, ()))
+        for subscription in subscriptions:
+            subscription._put(job_id)
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            for job_id in subscription.job_ids:
+                subscribers = self._subscribers.get(job_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[job_id]
@@ -0,0 +1,103 @@
+"""Content-addressed result payloads"""
+import gzip
+import hashlib
+import json
+import threading
+import weakref
+
+# Blob name prefix for content-addressed payloads in the output container
+PAYLOAD_PREFIX = 'payloads/'
+# Blob name prefix for the per-job pointers to a payload digest
+REF_PREFIX = 'refs/'
+
+
+class Payload:
+    """A result serialized once as compact JSON, plus its gzipped form.
+
+    Payloads are addressed by the SHA-256 of the JSON bytes, which also
+    serves as their ETag.
+    """
+
+    __slots__ = ('digest', 'body', 'gzip_body', '__weakref__')
+
+    def __init__(self, body, gzip_body=None):
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()
+        # mtime=0 keeps the compressed bytes identical across processes
+        self.gzip_body = gzip_body if gzip_body is not None else gzip.compress(body, mtime=0)
+
+    @classmethod
+    def from_obj(cls, obj):
+        return cls(json.dumps(obj, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_json(cls, data):
+        """Canonicalize JSON written by something else"""
+        return cls.from_obj(json.loads(data))
+
+    @classmethod
+    def from_gzip(cls, gzip_body):
+        return cls(gzip.decompress(gzip_body), gzip_body)
+
+    @property
+    def etag(self):
+        return self.digest[:32]
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.gzip_body)
+
+    @property
+    def blob_name(self):
+        return payload_blob_name(self.digest)
+
+
+def payload_blob_name(digest):
+    return f"{PAYLOAD_PREFIX}{digest}.json.gz"
+
+
+def ref_blob_name(job_id):
+    return f"{REF_PREFIX}{job_id}"
+
+
+class PayloadRegistry:
+    """Builds each distinct payload once and writes it to storage once.
+
+    Payloads built from a key are kept for the life of the process.
+    Payloads loaded from storage are only indexed weakly by digest, so
+    they live exactly as long as something (the result cache) holds them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = {}
+        self._by_digest = weakref.WeakValueDictionary()
+        self._stored = set()
+
+    def get_or_build(self, key, build):
+        """Return the payload for ``key``, serializing ``build()`` on first use"""
+        with self._lock:
+            payload = self._built.get(key)
+        if payload is None:
+            payload = self.add(Payload.from_obj(build()))
+            with self._lock:
+                payload = self._built.setdefault(key, payload)
+        return payload
+
+    def get(self, digest):
+        with self._lock:
+            return self._by_digest.get(digest)
+
+    def add(self, payload):
+        """Index a payload, returning the existing instance if already known"""
+        with self._lock:
+            return self._by_digest.setdefault(payload.digest, payload)
+
+    def ensure_stored(self, payload, write):
+        """Call ``write(payload)`` unless this process already stored it"""
+        with self._lock:
+            if payload.digest in self._stored:
+                return
+        write(payload)
+        with self._lock:
+            self._stored.add(payload.digest)
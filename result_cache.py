@@ -0,0 +1,80 @@
+"""In-process cache for job results"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """LRU cache of finished results bounded by total payload size.
+
+    Maps job IDs to result payloads (see payloads.Payload). Jobs sharing
+    a payload share one copy, which is only counted against the budget
+    once. Finished results never change, so they stay cached until
+    evicted. Jobs found to be still pending are remembered for
+    ``pending_ttl`` seconds so repeated polls don't each go to storage.
+    """
+
+    def __init__(self, max_bytes, pending_ttl=5, max_pending=10000):
+        self.max_bytes = max_bytes
+        self.pending_ttl = pending_ttl
+        self.max_pending = max_pending
+        self._results = OrderedDict()
+        # Number of cached jobs referencing each payload digest
+        self._refs = {}
+        self._pending = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            result = self._results.get(job_id)
+            if result is not None:
+                self._results.move_to_end(job_id)
+            return result
+
+    def put(self, job_id, payload):
+        """Cache the finished result payload of a job and return it"""
+        with self._lock:
+            self._pending.pop(job_id, None)
+            # Payloads larger than the whole budget are served but not kept
+            if payload.size > self.max_bytes:
+                return payload
+            old = self._results.pop(job_id, None)
+            if old is not None:
+                self._release(old)
+            self._results[job_id] = payload
+            refs = self._refs.get(payload.digest, 0)
+            if not refs:
+                self._size += payload.size
+            self._refs[payload.digest] = refs + 1
+            while self._size > self.max_bytes:
+                _, evicted = self._results.popitem(last=False)
+                self._release(evicted)
+        return payload
+
+    def _release(self, payload):
+        # Caller holds self._lock
+        refs = self._refs[payload.digest] - 1
+        if refs:
+            self._refs[payload.digest] = refs
+        else:
+            del self._refs[payload.digest]
+            self._size -= payload.size
+
+    def is_pending(self, job_id):
+        with self._lock:
+            expires = self._pending.get(job_id)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._pending[job_id]
+                return False
+            return True
+
+    def mark_pending(self, job_id):
+        with self._lock:
+            self._pending.pop(job_id, None)
+            self._pending[job_id] = time.monotonic() + self.pending_ttl
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+
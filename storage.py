@@ -0,0 +1,156 @@
+"""Azure Blob Storage helpers"""
+import asyncio
+import hashlib
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import chain
+
+# Default size of each staged block (1MB); with the default concurrency an
+# upload holds at most 5MB, well under the 10MB upload limit
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when a streamed upload exceeds the allowed size"""
+
+    def __init__(self, max_size):
+        super().__init__(f"Upload exceeds maximum size of {max_size} bytes")
+        self.max_size = max_size
+
+
+def hash_stream(stream, max_size, block_size=DEFAULT_BLOCK_SIZE):
+    """Return (sha256 hex digest, size) of a seekable stream and rewind it.
+
+    Used on uploads already spooled locally, so duplicates can be detected
+    before anything is sent to storage. Raises UploadTooLarge.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for data in iter(lambda: stream.read(block_size), b''):
+        size += len(data)
+        if size > max_size:
+            raise UploadTooLarge(max_size)
+        digest.update(data)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+
+def upload_stream(blob_client, stream, max_size, executor,
+                  block_size=DEFAULT_BLOCK_SIZE, max_concurrency=4):
+    """Stream a file-like object into a block blob in fixed-size blocks.
+
+    Blocks are staged in parallel on ``executor`` with at most
+    ``max_concurrency`` in flight, so an upload never holds more than
+    ``block_size * (max_concurrency + 1)`` bytes in memory (the blocks in
+    flight plus the one waiting for a free slot). The size limit is
+    enforced while reading; if it is exceeded the block list is never
+    committed and UploadTooLarge is raised. Returns the number of bytes
+    written.
+    """
+    first = stream.read(block_size)
+    if len(first) > max_size:
+        raise UploadTooLarge(max_size)
+
+    chunk = stream.read(block_size)
+    if not chunk:
+        # Small file: a single Put Blob is cheaper than stage + commit
+        blob_client.upload_blob(first, overwrite=True)
+        return len(first)
+
+    block_ids = []
+    in_flight = set()
+    total = 0
+
+    def stage(data):
+        nonlocal in_flight
+        # Block ids must all have the same length within a blob
+        block_id = f"{len(block_ids):08d}"
+        block_ids.append(block_id)
+        if len(in_flight) >= max_concurrency:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        in_flight.add(executor.submit(blob_client.stage_block, block_id, data, length=len(data)))
+
+    try:
+        rest = iter(lambda: stream.read(block_size), b'')
+        for data in chain((first, chunk), rest):
+            total += len(data)
+            if total > max_size:
+                raise UploadTooLarge(max_size)
+            stage(data)
+        for future in wait(in_flight)[0]:
+            future.result()
+    except BaseException:
+        # Uncommitted blocks are discarded by the service, nothing to clean up
+        for future in in_flight:
+            future.cancel()
+        raise
+
+    blob_client.commit_block_list(block_ids)
+    return total
+
+
+async def hash_stream_async(stream, max_size, block_size=DEFAULT_BLOCK_SIZE):
+    """Async counterpart of hash_stream for Starlette's UploadFile"""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        data = await stream.read(block_size)
+        if not data:
+            break
+        size += len(data)
+        if size > max_size:
+            raise UploadTooLarge(max_size)
+        digest.update(data)
+    await stream.seek(0)
+    return digest.hexdigest(), size
+
+
+async def upload_stream_async(blob_client, stream, max_size,
+                              block_size=DEFAULT_BLOCK_SIZE, max_concurrency=4):
+    """Async counterpart of upload_stream for ``azure.storage.blob.aio`` clients.
+
+    ``stream`` must have an awaitable ``read(size)``, such as Starlette's
+    UploadFile.
+    """
+    first = await stream.read(block_size)
+    if len(first) > max_size:
+        raise UploadTooLarge(max_size)
+
+    chunk = await stream.read(block_size)
+    if not chunk:
+        await blob_client.upload_blob(first, overwrite=True)
+        return len(first)
+
+    block_ids = []
+    in_flight = set()
+    total = 0
+    data = first
+    try:
+        while data:
+            total += len(data)
+            if total > max_size:
+                raise UploadTooLarge(max_size)
+            block_id = f"{len(block_ids):08d}"
+            block_ids.append(block_id)
+            if len(in_flight) >= max_concurrency:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            in_flight.add(asyncio.ensure_future(
+                blob_client.stage_block(block_id, data, length=len(data))
+            ))
+            if chunk is not None:
+                data, chunk = chunk, None
+            else:
+                data = await stream.read(block_size)
+        if in_flight:
+            for task in (await asyncio.wait(in_flight))[0]:
+                task.result()
+    except BaseException:
+        for task in in_flight:
+            task.cancel()
+        raise
+
+    await blob_client.commit_block_list(block_ids)
+    return total
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app is configured from the environment when it's imported: keep
+# everything in memory or a scratch directory, and run jobs without delay
+_scratch = tempfile.mkdtemp(prefix='alert-grader-tests-')
+os.environ.update(
+    STORAGE_BACKEND='memory',
+    JOB_DB_PATH=os.path.join(_scratch, 'jobs.db'),
+    PROCESSING_DELAY_MIN='0',
+    PROCESSING_DELAY_MAX='0',
+    LOG_LEVEL='WARNING'
+)
+os.environ.pop('WEBSITE_INSTANCE_ID', None)
+os.environ.pop('JOB_JOURNAL', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import JobStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.db'))
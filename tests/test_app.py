@@ -0,0 +1,128 @@
+import hashlib
+import io
+import json
+import time
+import uuid
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def upload(client, content, filename='alerts.csv'):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(content), filename)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def result(client, job_id):
+    return client.get(f'/api/result/{job_id}?wait=10').get_json()
+
+
+def unique_content():
+    return f'alert,{uuid.uuid4()}\n'.encode('utf-8')
+
+
+def index_entry(content, filename):
+    key = app.dedup_key(hashlib.sha256(content).hexdigest(), filename)
+    data = app.storage_backend.get(app.INPUT_CONTAINER, app.input_index_blob_name(key))
+    return key, json.loads(data)
+
+
+def test_duplicates_reuse_the_original_result(client):
+    content = unique_content()
+    first = upload(client, content)
+    assert 'Grading Metrics' in result(client, first['job_id'])
+
+    second = upload(client, content)
+    assert second['duplicate_of'] == first['job_id']
+    assert second['filename'] == first['filename']
+    assert result(client, second['job_id']) == result(client, first['job_id'])
+
+
+def test_duplicates_must_get_the_same_output(client):
+    content = unique_content()
+    sample = upload(client, content, 'sample-alerts.csv')
+    assert result(client, sample['job_id'])['Grading Metrics']['Match %'] == 95.2
+
+    other = upload(client, content, 'other.csv')
+    assert 'duplicate_of' not in other
+    assert result(client, other['job_id'])['Grading Metrics']['Match %'] == 78.5
+
+
+def test_index_entry_for_a_long_dead_job_is_replaced(client):
+    content = unique_content()
+    key = app.dedup_key(hashlib.sha256(content).hexdigest(), 'alerts.csv')
+    # Left behind by a host whose job table was lost an hour ago
+    app.storage_backend.put(app.INPUT_CONTAINER, app.input_index_blob_name(key),
+                            app.input_index_entry('lost-job', 'lost.csv', time.time() - 3600))
+
+    fresh = upload(client, content)
+    assert 'duplicate_of' not in fresh
+    assert 'Grading Metrics' in result(client, fresh['job_id'])
+    assert index_entry(content, 'alerts.csv')[1]['job_id'] == fresh['job_id']
+
+    assert upload(client, content)['duplicate_of'] == fresh['job_id']
+
+
+def test_duplicate_of_a_job_that_never_finishes_takes_over(client, monkeypatch):
+    monkeypatch.setattr(app, 'DUPLICATE_MAX_WAIT', 1)
+    monkeypatch.setattr(app, 'DUPLICATE_RETRY_INTERVAL', 0.1)
+    content = unique_content()
+    key = app.dedup_key(hashlib.sha256(content).hexdigest(), 'alerts.csv')
+    # A job just queued on another host, which then went away
+    app.storage_backend.put(app.INPUT_CONTAINER, 'lost.csv', content)
+    app.storage_backend.put(app.INPUT_CONTAINER, app.input_index_blob_name(key),
+                            app.input_index_entry('lost-job', 'lost.csv', time.time()))
+
+    waiting = upload(client, content)
+    assert waiting['duplicate_of'] == 'lost-job'
+    assert 'Grading Metrics' in result(client, waiting['job_id'])
+
+    job = app.job_scheduler.store.get(waiting['job_id'])
+    assert job['source_job_id'] is None
+    assert index_entry(content, 'alerts.csv')[1]['job_id'] == waiting['job_id']
+    assert upload(client, content)['duplicate_of'] == waiting['job_id']
+
+
+def test_force_processes_identical_content_again(client):
+    content = unique_content()
+    first = upload(client, content)
+    response = client.post('/api/upload?force=true', data={'file': (io.BytesIO(content), 'alerts.csv')},
+                           content_type='multipart/form-data')
+    assert 'duplicate_of' not in response.get_json()
+    assert response.get_json()['job_id'] != first['job_id']
+
+
+def test_job_listing_pages_across_equal_upload_times(client, monkeypatch):
+    monkeypatch.setattr(app, 'LISTING_TOKEN', 'secret')
+    headers = {'Authorization': 'Bearer secret'}
+    job_ids = {upload(client, unique_content())['job_id'] for _ in range(5)}
+    placeholders = ', '.join('?' * len(job_ids))
+    app.job_scheduler.store._conn().execute(
+        f'UPDATE jobs SET created_at = 4102444800 WHERE job_id IN ({placeholders})', tuple(job_ids)
+    )
+
+    seen, cursor = [], None
+    for _ in range(len(job_ids)):
+        query = '/api/jobs?limit=2&since=2100-01-01T00:00:00' + (f'&cursor={cursor}' if cursor else '')
+        body = client.get(query, headers=headers).get_json()
+        seen.extend(job['job_id'] for job in body['jobs'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+
+    assert seen == sorted(job_ids, reverse=True)
+
+
+def test_job_listing_rejects_bad_cursors_and_missing_tokens(client, monkeypatch):
+    monkeypatch.setattr(app, 'LISTING_TOKEN', 'secret')
+    assert client.get('/api/jobs').status_code == 401
+    response = client.get('/api/jobs?cursor=not-a-cursor', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 400
@@ -0,0 +1,46 @@
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+
+BOUNDARY = 'test-boundary'
+MULTIPART = {'content-type': f'multipart/form-data; boundary={BOUNDARY}'}
+
+
+def file_part(filename, content):
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: text/csv\r\n\r\n').encode('utf-8') + content + b'\r\n'
+
+
+@pytest.fixture(scope='module')
+def client():
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def test_malformed_content_length_is_a_bad_request(client):
+    response = client.post('/api/upload', content=b'x',
+                           headers={**MULTIPART, 'content-length': 'abc'})
+    assert response.status_code == 400
+
+
+def test_unparseable_body_has_no_file(client):
+    response = client.post('/api/upload', content=b'garbage',
+                           headers={'content-type': 'multipart/form-data'})
+    assert (response.status_code, response.json()) == (400, {"error": "No file provided"})
+
+
+def test_first_of_several_files_is_used(client):
+    body = file_part('first.csv', b'a,b\n') + file_part('second.csv', b'c,d\n') + f'--{BOUNDARY}--\r\n'.encode()
+    response = client.post('/api/upload', content=body, headers=MULTIPART)
+    assert response.status_code == 200
+
+
+def test_chunked_body_is_cut_off_at_the_size_limit(client):
+    def chunks():
+        yield file_part('big.csv', b'')[:-2]
+        for _ in range(40):
+            yield b'a' * 1024 * 1024
+
+    response = client.post('/api/upload', content=chunks(), headers=MULTIPART)
+    assert (response.status_code, response.json()) == (400, {"error": asgi.core.FILE_TOO_LARGE_ERROR})
@@ -0,0 +1,208 @@
+import threading
+import time
+
+import pytest
+
+from backends import MemoryBackend
+from jobs import (BlobJournal, JobScheduler, JobStore, QueueFull, Retry,
+                  DONE, FAILED, QUEUED, RUNNING)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_claim_due_hands_each_job_to_one_worker(store):
+    other = JobStore(store.path)
+    store.add('a', {}, time.time() - 1)
+
+    claimed = store.claim_due(10, lease=60) + other.claim_due(10, lease=60)
+
+    assert [job['job_id'] for job in claimed] == ['a']
+    job = store.get('a')
+    assert job['status'] == RUNNING
+    assert job['attempts'] == 1
+
+
+def test_claim_due_skips_jobs_not_yet_due(store):
+    store.add('later', {}, time.time() + 60)
+    assert store.claim_due(10, lease=60) == []
+    assert store.next_run_at() > time.time()
+
+
+def test_defer_requeues_without_using_an_attempt(store):
+    store.add('a', {}, time.time() - 1)
+    store.claim_due(1, lease=60)
+
+    store.defer('a', time.time() + 30)
+
+    job = store.get('a')
+    assert job['status'] == QUEUED
+    assert job['attempts'] == 0
+    assert job['lease_until'] is None
+
+
+def test_retry_requeues_and_keeps_the_attempt(store):
+    store.add('a', {}, time.time() - 1)
+    store.claim_due(1, lease=60)
+
+    store.retry('a', time.time() + 30, 'boom')
+
+    job = store.get('a')
+    assert job['status'] == QUEUED
+    assert job['attempts'] == 1
+    assert job['error'] == 'boom'
+
+
+def test_recover_expired_requeues_jobs_whose_lease_lapsed(store):
+    store.add('lapsed', {}, time.time() - 1)
+    store.add('live', {}, time.time() - 1)
+    store.claim_due(1, lease=-1)
+    store.claim_due(1, lease=60)
+
+    assert store.recover_expired() == 1
+    assert store.get('lapsed')['status'] == QUEUED
+    assert store.get('live')['status'] == RUNNING
+
+
+def test_add_enforces_the_pending_limit(store):
+    store.add('a', {}, time.time(), max_pending=2)
+    store.add('b', {}, time.time(), max_pending=2)
+    with pytest.raises(QueueFull):
+        store.add('c', {}, time.time(), max_pending=2)
+
+    # Finished jobs don't count towards the limit
+    store.finish('a', DONE, result='digest')
+    store.add('c', {}, time.time(), max_pending=2)
+    assert store.pending_counts() == {QUEUED: 2, RUNNING: 0}
+
+
+def test_finish_records_result_and_finish_time(store):
+    store.add('a', {}, time.time())
+    store.finish('a', DONE, result='digest', result_size=42)
+
+    job = store.get('a')
+    assert (job['status'], job['result'], job['result_size']) == (DONE, 'digest', 42)
+    assert job['finished_at'] is not None
+
+
+def test_take_over_detaches_a_duplicate_and_moves_its_waiters(store):
+    store.add('source', {}, time.time(), input_digest='key')
+    store.add('first', {}, time.time(), input_digest='key', source_job_id='source')
+    store.add('second', {}, time.time(), input_digest='key', source_job_id='source')
+
+    store.take_over('first', 'source')
+
+    assert store.get('first')['source_job_id'] is None
+    assert store.waiting_on('first') == ['second']
+    store.finish('source', FAILED, 'lost')
+    assert store.find_by_input_digest('key')['job_id'] == 'first'
+
+
+def test_page_walks_jobs_with_equal_timestamps(store):
+    job_ids = [f'job-{index:02d}' for index in range(7)]
+    for job_id in job_ids:
+        store.add(job_id, {}, time.time())
+    store._conn().execute('UPDATE jobs SET created_at = 1000')
+
+    seen, after = [], None
+    while True:
+        page = store.page(3, 'created_at', after=after)
+        seen.extend(job['job_id'] for job in page)
+        if len(page) < 3:
+            break
+        after = (page[-1]['created_at'], page[-1]['job_id'])
+
+    assert seen == sorted(job_ids, reverse=True)
+
+
+def test_page_filters_by_status_and_time(store):
+    for job_id, created_at in (('old', 100), ('mid', 200), ('new', 300)):
+        store.add(job_id, {}, time.time())
+        store._conn().execute('UPDATE jobs SET created_at = ? WHERE job_id = ?', (created_at, job_id))
+    store.finish('mid', DONE, result='digest')
+
+    assert [job['job_id'] for job in store.page(10, since=150, until=300)] == ['mid']
+    assert [job['job_id'] for job in store.page(10, status=QUEUED)] == ['new', 'old']
+    with pytest.raises(ValueError):
+        store.page(10, order_by='payload')
+
+
+def run_scheduler(store, handler, **options):
+    scheduler = JobScheduler(store, handler, poll_interval=0.05, **options)
+    scheduler.start()
+    return scheduler
+
+
+def test_scheduler_runs_due_jobs_and_records_result_columns(store):
+    scheduler = run_scheduler(store, lambda job_id, payload: {"result": payload['n'], "result_size": 3})
+    try:
+        scheduler.submit('a', {'n': 'abc'})
+        assert wait_for(lambda: store.get('a')['status'] == DONE)
+        assert store.get('a')['result_size'] == 3
+    finally:
+        scheduler.stop()
+
+
+def test_scheduler_defers_on_retry_and_fails_after_max_attempts(store):
+    calls = []
+    failed = threading.Event()
+
+    def handler(job_id, payload):
+        calls.append(job_id)
+        if job_id == 'waits' and len(calls) < 3:
+            raise Retry(0)
+        if job_id == 'broken':
+            raise RuntimeError('boom')
+
+    scheduler = run_scheduler(store, handler, max_attempts=1, on_failed=lambda job_id: failed.set())
+    try:
+        scheduler.submit('waits', {})
+        assert wait_for(lambda: store.get('waits')['status'] == DONE)
+        # Retries don't use up attempts
+        assert store.get('waits')['attempts'] == 1
+
+        scheduler.submit('broken', {})
+        assert failed.wait(5)
+        job = store.get('broken')
+        assert (job['status'], job['error']) == (FAILED, 'boom')
+    finally:
+        scheduler.stop()
+
+
+def test_scheduler_refuses_work_past_max_pending(store):
+    scheduler = JobScheduler(store, lambda job_id, payload: None, max_pending=1)
+    scheduler.submit('a', {}, delay=60)
+    assert scheduler.is_full()
+    with pytest.raises(QueueFull):
+        scheduler.submit('b', {}, delay=60)
+
+
+def test_journal_restores_queued_jobs_into_a_new_job_table(tmp_path):
+    backend = MemoryBackend()
+    first = JobScheduler(JobStore(str(tmp_path / 'first.db')), lambda job_id, payload: None,
+                         journal=BlobJournal(backend, 'input', 'host-1'))
+    first.submit('queued', {'n': 1}, delay=60, size=10)
+    first.submit('finished', {'n': 2}, delay=60)
+    first.finish('finished', DONE, result='digest')
+    assert list(backend.list('input', 'jobs/')) == ['jobs/queued']
+
+    # Same host, job table lost
+    restarted = JobScheduler(JobStore(str(tmp_path / 'restarted.db')), lambda job_id, payload: None,
+                             journal=BlobJournal(backend, 'input', 'host-1'))
+    assert restarted.adopt() == 1
+    job = restarted.store.get('queued')
+    assert (job['status'], job['size']) == (QUEUED, 10)
+    assert restarted.adopt() == 0
+
+    # Another host leaves it alone until it's long overdue
+    other = JobScheduler(JobStore(str(tmp_path / 'other.db')), lambda job_id, payload: None,
+                         journal=BlobJournal(backend, 'input', 'host-2', grace=3600))
+    assert other.adopt() == 0
+    other.journal.grace = -120
+    assert other.adopt() == 1